@@ -0,0 +1,163 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+# vim:fenc=utf-8
+#
+# TradeWiSE Project
+#
+# This file is part of the TradeWiSE project, an automated trading and financial analysis platform.
+# It is licensed under the Mozilla Public License 2.0 (MPL 2.0), which allows for wide use and modification
+# while ensuring that enhancements and modifications remain available to the community.
+#
+# You can find the MPL 2.0 license in the root directory of the project or at https://www.mozilla.org/MPL/2.0/.
+#
+# Copyright (c) 2023 by wildfootw <wildfootw@wildfoo.tw>
+#
+
+import datetime
+import mmap
+import os
+import threading
+from typing import Dict, Iterable, List, Optional
+
+import numpy as np
+
+BAR_DTYPE = np.dtype([
+    ("time", "<i8"),        # Start of the bar, seconds since epoch
+    ("open", "<f8"),
+    ("high", "<f8"),
+    ("low", "<f8"),
+    ("close", "<f8"),
+    ("volume", "<i8"),
+])
+
+SUFFIX = ".bars"
+
+TAIPEI = datetime.timezone(datetime.timedelta(hours=8))
+
+def to_timestamp(value: str) -> int:
+    """Converts a Fugle date ("2023-05-29") or time ("2023-05-29T09:00:00.000+08:00") to epoch seconds."""
+    moment = datetime.datetime.fromisoformat(value)
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=TAIPEI)
+    return int(moment.timestamp())
+
+def partition_of(timeframe: str, timestamp: int) -> str:
+    date = datetime.datetime.fromtimestamp(timestamp, TAIPEI).date()
+    return str(date.year) if timeframe == "D" else date.isoformat()
+
+def to_bars(candles: Iterable[Dict]) -> np.ndarray:
+    """Converts Fugle candles to a bar array sorted by time."""
+    rows = [
+        (to_timestamp(candle["date"]), candle["open"], candle["high"], candle["low"], candle["close"], candle.get("volume") or 0)
+        for candle in candles
+    ]
+    bars = np.array(rows, dtype=BAR_DTYPE)
+    return np.sort(bars, order="time")
+
+class BarStore:
+    """
+    Local time-series store of OHLCV bars.
+
+    Bars are kept per timeframe and symbol as raw `BAR_DTYPE` records sorted by time, one file per
+    partition: `<root>/<timeframe>/<symbol>/<partition>.bars`. Daily bars ("D") are partitioned by
+    year and intraday candles (e.g. "1" for 1 minute) by trading day. Queries memory-map the
+    partitions they cover and slice them by time without copying. Bars newer than a partition are
+    appended to its file in place, older ones are merged into a rewritten file.
+
+    The files have no header, a reader maps one with a single mmap call instead of parsing a `.npy`
+    header each time, which is what dominates a query over the whole market.
+    """
+    def __init__(self, root: str):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+        self._lock = threading.Lock()
+
+    # Plain string paths, pathlib costs more than the mapping itself on small partitions
+    def _symbol_dir(self, timeframe: str, symbol: str) -> str:
+        return os.path.join(self.root, timeframe, symbol)
+
+    def _partitions(self, timeframe: str, symbol: str) -> List[str]:
+        try:
+            names = os.listdir(self._symbol_dir(timeframe, symbol))
+        except FileNotFoundError:
+            return []
+        return sorted(name[:-len(SUFFIX)] for name in names if name.endswith(SUFFIX))
+
+    @staticmethod
+    def _map(path: str) -> np.ndarray:
+        with open(path, "rb") as f:
+            size = os.fstat(f.fileno()).st_size
+            if size < BAR_DTYPE.itemsize:
+                return np.empty(0, dtype=BAR_DTYPE)
+            # The mapping stays valid after the file is closed, and even after it is replaced
+            buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return np.frombuffer(buffer, dtype=BAR_DTYPE, count=size // BAR_DTYPE.itemsize)
+
+    def append(self, timeframe: str, symbol: str, bars: np.ndarray) -> int:
+        """
+        Merges `bars` into the stored series, replacing stored bars with the same time. Returns the
+        number of bars that were not stored before.
+        """
+        if len(bars) == 0:
+            return 0
+        symbol_dir = self._symbol_dir(timeframe, symbol)
+        os.makedirs(symbol_dir, exist_ok=True)
+
+        bars = np.sort(bars.astype(BAR_DTYPE, copy=False), order="time")
+        partitions = np.array([partition_of(timeframe, int(t)) for t in bars["time"]])
+        added = 0
+        with self._lock:
+            for partition in np.unique(partitions):
+                new = bars[partitions == partition]
+                path = os.path.join(symbol_dir, f"{partition}{SUFFIX}")
+                old = self._map(path) if os.path.exists(path) else np.empty(0, dtype=BAR_DTYPE)
+                if len(old) == 0 or new["time"][0] > old["time"][-1]:
+                    with open(path, "ab") as f:
+                        f.write(new.tobytes())
+                    added += len(new)
+                    continue
+
+                kept = old[~np.isin(old["time"], new["time"])]
+                added += len(new) - (len(old) - len(kept))
+                merged = np.sort(np.concatenate([kept, new]), order="time")
+                # Readers keep the previous file mapped until they are done with it
+                tmp_path = f"{path}.tmp"
+                with open(tmp_path, "wb") as f:
+                    f.write(merged.tobytes())
+                os.replace(tmp_path, path)
+        return added
+
+    def last_time(self, timeframe: str, symbol: str) -> Optional[int]:
+        partitions = self._partitions(timeframe, symbol)
+        if not partitions:
+            return None
+        bars = self._map(os.path.join(self._symbol_dir(timeframe, symbol), f"{partitions[-1]}{SUFFIX}"))
+        return int(bars["time"][-1]) if len(bars) else None
+
+    def query(self, timeframe: str, symbol: str, start: int, end: int) -> np.ndarray:
+        """Returns the bars with start <= time <= end. A range within one partition is not copied."""
+        first = partition_of(timeframe, start)
+        last = partition_of(timeframe, end)
+        symbol_dir = self._symbol_dir(timeframe, symbol)
+        chunks = []
+        for partition in self._partitions(timeframe, symbol):
+            if not first <= partition <= last:
+                continue
+            bars = self._map(os.path.join(symbol_dir, f"{partition}{SUFFIX}"))
+            lo = np.searchsorted(bars["time"], start, side="left")
+            hi = np.searchsorted(bars["time"], end, side="right")
+            if hi > lo:
+                chunks.append(bars[lo:hi])
+        if not chunks:
+            return np.empty(0, dtype=BAR_DTYPE)
+        return chunks[0] if len(chunks) == 1 else np.concatenate(chunks)
+
+    def symbols(self, timeframe: str) -> List[str]:
+        try:
+            return sorted(entry.name for entry in os.scandir(os.path.join(self.root, timeframe)) if entry.is_dir())
+        except FileNotFoundError:
+            return []
+
+def to_columns(bars: np.ndarray) -> Dict[str, np.ndarray]:
+    """Splits bars into one contiguous array per field, the layout orjson serializes natively."""
+    return {name: np.ascontiguousarray(bars[name]) for name in BAR_DTYPE.names}
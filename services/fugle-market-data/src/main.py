@@ -13,11 +13,23 @@
 # Copyright (c) 2023 by wildfootw <wildfootw@wildfoo.tw>
 #
 
+import asyncio
+import datetime
+import json
 import logging
 import os
+import re
+from contextlib import asynccontextmanager
+from typing import Dict, List, Optional
 
-from fastapi import FastAPI
-from fugle_marketdata import RestClient
+import orjson
+from bar_store import TAIPEI, BarStore, to_bars, to_columns
+from fastapi import FastAPI, HTTPException, Response, WebSocket
+from fastapi.responses import StreamingResponse
+from fugle_marketdata import RestClient, WebSocketClient
+from quote_cache import QuoteCache
+from rate_limiter import TokenBucket
+from streaming import QuoteStream
 
 
 def get_env_or_raise(name: str) -> str:
@@ -28,12 +40,55 @@ def get_env_or_raise(name: str) -> str:
 
 fugle_marketdata_api_key = get_env_or_raise('FUGLE_MARKET_DATA_API_KEY')
 
-app = FastAPI()
+# Seconds a quote is served from memory before it is fetched again
+QUOTE_CACHE_TTL = float(os.getenv('QUOTE_CACHE_TTL', '1'))
+
+# Fugle API quota per rolling minute, and how many of those calls may be made in a burst
+FUGLE_CALLS_PER_MINUTE = int(os.getenv('FUGLE_CALLS_PER_MINUTE', '60'))
+FUGLE_BURST = int(os.getenv('FUGLE_BURST', '10'))
+# Upstream calls running at once, each one holds an executor thread
+FUGLE_MAX_CONCURRENCY = int(os.getenv('FUGLE_MAX_CONCURRENCY', '10'))
+
+# Limits of the batch endpoint
+PRICES_MAX_SYMBOLS = int(os.getenv('PRICES_MAX_SYMBOLS', '200'))
+PRICES_TIMEOUT = float(os.getenv('PRICES_TIMEOUT', '10'))
+
+# Streaming quotes: ticks kept per symbol, updates buffered per consumer, and SSE keep-alive interval
+STREAM_RING_SIZE = int(os.getenv('STREAM_RING_SIZE', '4096'))
+STREAM_QUEUE_SIZE = int(os.getenv('STREAM_QUEUE_SIZE', '256'))
+STREAM_KEEPALIVE = float(os.getenv('STREAM_KEEPALIVE', '15'))
+
+# Local bar store, and how far back daily bars go when a symbol is ingested for the first time
+BARS_DIR = os.getenv('BARS_DIR', '/var/lib/fugle-market-data/bars')
+BARS_HISTORY_DAYS = int(os.getenv('BARS_HISTORY_DAYS', '365'))
+# Longest date range of a single historical candles request
+BARS_CHUNK_DAYS = 365
+BAR_TIMEFRAMES = {"D", "1", "3", "5", "10", "15", "30", "60"}
+# Symbols become directory names in the bar store
+SYMBOL_PATTERN = re.compile(r"^[0-9A-Za-z]+$")
 
 logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
 
+# One client for the lifetime of the service
+client = RestClient(api_key=fugle_marketdata_api_key)
+
+# The WebSocket connection is opened by the first stream subscriber
+quote_stream = QuoteStream(
+    WebSocketClient(api_key=fugle_marketdata_api_key).stock,
+    ring_size=STREAM_RING_SIZE,
+    queue_size=STREAM_QUEUE_SIZE,
+)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    yield
+    quote_stream.close()
+
+app = FastAPI(lifespan=lifespan)
+
+bar_store = BarStore(BARS_DIR)
+
 def get_stock_price(symbol: str):
-    client = RestClient(api_key=fugle_marketdata_api_key)
     data = client.stock.intraday.quote(symbol=symbol)
 
     if not isinstance(data, dict):
@@ -58,6 +113,232 @@ def get_stock_price(symbol: str):
     }
     return price_data
 
+# A full burst plus a minute of refill stays within the quota of any minute
+limiter = TokenBucket(rate=max(FUGLE_CALLS_PER_MINUTE - FUGLE_BURST, 1) / 60, capacity=FUGLE_BURST)
+upstream_slots = asyncio.Semaphore(FUGLE_MAX_CONCURRENCY)
+
+async def call_upstream(func, *args):
+    async with upstream_slots:
+        await limiter.acquire()
+        # The SDK client is blocking, keep it off the event loop
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, func, *args)
+
+async def fetch_stock_price(symbol: str):
+    return await call_upstream(get_stock_price, symbol)
+
+quote_cache = QuoteCache(fetch_stock_price, ttl=QUOTE_CACHE_TTL)
+
 @app.get("/price/{symbol}")
 async def read_price(symbol: str):
-    return get_stock_price(symbol)
+    return await quote_cache.get(symbol)
+
+# Quote lookups still running after their batch request timed out, they go on to fill the cache
+background_lookups = set()
+
+def finish_in_background(task: asyncio.Task):
+    background_lookups.add(task)
+    task.add_done_callback(background_lookups.discard)
+    # Nobody awaits the task anymore, retrieve its exception so that it is not reported as lost
+    task.add_done_callback(lambda task: task.cancelled() or task.exception())
+
+@app.get("/prices")
+async def read_prices(symbols: str, timeout: float = PRICES_TIMEOUT):
+    """
+    Returns the quotes of many comma-separated symbols as {"prices": {symbol: quote}, "errors":
+    {symbol: message}}. Cached quotes are served right away, the others are fetched concurrently
+    under the upstream rate limit, and symbols still pending after `timeout` seconds are reported
+    as errors.
+    """
+    symbol_list = list(dict.fromkeys(symbol.strip() for symbol in symbols.split(",") if symbol.strip()))
+    if not symbol_list:
+        raise HTTPException(status_code=400, detail="No symbols given")
+    if len(symbol_list) > PRICES_MAX_SYMBOLS:
+        raise HTTPException(status_code=400, detail=f"At most {PRICES_MAX_SYMBOLS} symbols per request")
+
+    tasks = {symbol: asyncio.ensure_future(quote_cache.get(symbol)) for symbol in symbol_list}
+    await asyncio.wait(tasks.values(), timeout=timeout)
+
+    prices = {}
+    errors = {}
+    for symbol, task in tasks.items():
+        if not task.done():
+            finish_in_background(task)
+            errors[symbol] = "Timed out waiting for the quote"
+        elif task.exception() is not None:
+            logging.error(f"Failed to get stock price of {symbol}: {task.exception()!r}")
+            errors[symbol] = repr(task.exception())
+        elif "error" in task.result():
+            errors[symbol] = task.result()["error"]
+        else:
+            prices[symbol] = task.result()
+    return {"prices": prices, "errors": errors}
+
+@app.get("/stream/{symbol}")
+async def stream_trades(symbol: str):
+    """Server-sent events of the live trades of `symbol`, starting with the latest one."""
+    async def events():
+        queue = await quote_stream.subscribe(symbol)
+        try:
+            if symbol in quote_stream.latest:
+                yield f"data: {json.dumps(quote_stream.latest[symbol])}\n\n"
+            while True:
+                try:
+                    trade = await asyncio.wait_for(queue.get(), STREAM_KEEPALIVE)
+                except asyncio.TimeoutError:
+                    yield ": keep-alive\n\n"
+                    continue
+                yield f"data: {json.dumps(trade)}\n\n"
+        finally:
+            quote_stream.unsubscribe(symbol, queue)
+
+    return StreamingResponse(events(), media_type="text/event-stream")
+
+@app.websocket("/ws/{symbol}")
+async def websocket_trades(websocket: WebSocket, symbol: str):
+    """Same as /stream/{symbol}, over a WebSocket."""
+    await websocket.accept()
+    queue = await quote_stream.subscribe(symbol)
+
+    async def forward():
+        if symbol in quote_stream.latest:
+            await websocket.send_json(quote_stream.latest[symbol])
+        while True:
+            await websocket.send_json(await queue.get())
+
+    sender = asyncio.create_task(forward())
+    try:
+        # Consumers only listen, reading is how the disconnect is noticed
+        while (await websocket.receive())["type"] != "websocket.disconnect":
+            pass
+    finally:
+        sender.cancel()
+        quote_stream.unsubscribe(symbol, queue)
+
+@app.get("/ticks/{symbol}")
+async def read_ticks(symbol: str, limit: int = 100):
+    """The latest streamed trade and up to `limit` recent ticks of `symbol`, as columns."""
+    ring = quote_stream.rings.get(symbol)
+    if ring is None:
+        raise HTTPException(status_code=404, detail=f"No streamed ticks for {symbol}")
+    return {"symbol": symbol, "latest": quote_stream.latest.get(symbol), "ticks": ring.last(limit)}
+
+@app.get("/stats")
+async def read_stats():
+    return {**quote_cache.stats(), "rate_limited_calls": limiter.waits, "stream": quote_stream.stats()}
+
+def get_candles(symbol: str, timeframe: str, start: Optional[datetime.date] = None, end: Optional[datetime.date] = None) -> List[Dict]:
+    """Daily candles of `symbol` from `start` to `end`, or the intraday candles of the current session."""
+    if timeframe == "D":
+        data = client.stock.historical.candles(**{
+            "symbol": symbol,
+            "from": start.isoformat(),
+            "to": end.isoformat(),
+            "fields": "open,high,low,close,volume",
+        })
+    else:
+        data = client.stock.intraday.candles(symbol=symbol, timeframe=timeframe)
+
+    if not isinstance(data, dict):
+        raise ValueError(f"Unexpected response: {data!r}")
+    if (status_code := data.get("statusCode")) and status_code != 200:
+        raise ValueError(f"Failed to get candles: {data.get('message')}")
+    return data.get("data") or []
+
+async def ingest_bars(symbol: str, timeframe: str, start: Optional[datetime.date] = None) -> int:
+    """Fetches the bars of `symbol` missing from the store and appends them. Returns the number of new bars."""
+    loop = asyncio.get_running_loop()
+    if timeframe != "D":
+        candles = await call_upstream(get_candles, symbol, timeframe)
+        return await loop.run_in_executor(None, bar_store.append, timeframe, symbol, to_bars(candles))
+
+    today = datetime.datetime.now(TAIPEI).date()
+    if start is None:
+        last_time = bar_store.last_time("D", symbol)
+        if last_time is None:
+            start = today - datetime.timedelta(days=BARS_HISTORY_DAYS)
+        else:
+            # The last stored day is fetched again, it may have been stored before the close
+            start = datetime.datetime.fromtimestamp(last_time, TAIPEI).date()
+
+    added = 0
+    while start <= today:
+        end = min(start + datetime.timedelta(days=BARS_CHUNK_DAYS - 1), today)
+        candles = await call_upstream(get_candles, symbol, "D", start, end)
+        added += await loop.run_in_executor(None, bar_store.append, "D", symbol, to_bars(candles))
+        start = end + datetime.timedelta(days=1)
+    return added
+
+def parse_bar_symbols(symbols: str) -> List[str]:
+    symbol_list = list(dict.fromkeys(symbol.strip() for symbol in symbols.split(",") if symbol.strip()))
+    if not symbol_list:
+        raise HTTPException(status_code=400, detail="No symbols given")
+    for symbol in symbol_list:
+        if not SYMBOL_PATTERN.match(symbol):
+            raise HTTPException(status_code=400, detail=f"Invalid symbol {symbol!r}")
+    return symbol_list
+
+def check_timeframe(timeframe: str):
+    if timeframe not in BAR_TIMEFRAMES:
+        raise HTTPException(status_code=400, detail=f"Timeframe must be one of {sorted(BAR_TIMEFRAMES)}")
+
+def time_range(start: Optional[datetime.date], end: Optional[datetime.date]):
+    """Epoch seconds from the beginning of `start` to the end of `end`, both Taipei dates. Defaults to the last year."""
+    end = end or datetime.datetime.now(TAIPEI).date()
+    start = start or end - datetime.timedelta(days=365)
+    start_time = datetime.datetime.combine(start, datetime.time(), TAIPEI)
+    end_time = datetime.datetime.combine(end + datetime.timedelta(days=1), datetime.time(), TAIPEI)
+    return int(start_time.timestamp()), int(end_time.timestamp()) - 1
+
+def bars_response(payload: Dict) -> Response:
+    # Columns are NumPy arrays, orjson writes them without going through Python lists
+    return Response(orjson.dumps(payload, option=orjson.OPT_SERIALIZE_NUMPY), media_type="application/json")
+
+@app.post("/bars/ingest")
+async def ingest(symbols: str, timeframe: str = "D", start: Optional[datetime.date] = None):
+    """
+    Appends the bars of many comma-separated symbols to the local store: daily bars since the last
+    stored day (or `start`, or `BARS_HISTORY_DAYS` back for a new symbol), or the intraday candles
+    of the current session. Returns {"ingested": {symbol: new bars}, "errors": {symbol: message}}.
+    """
+    symbol_list = parse_bar_symbols(symbols)
+    check_timeframe(timeframe)
+
+    results = await asyncio.gather(*(ingest_bars(symbol, timeframe, start) for symbol in symbol_list), return_exceptions=True)
+    ingested = {}
+    errors = {}
+    for symbol, result in zip(symbol_list, results):
+        if isinstance(result, Exception):
+            logging.error(f"Failed to ingest {timeframe} bars of {symbol}: {result!r}")
+            errors[symbol] = str(result)
+        else:
+            ingested[symbol] = result
+    return {"ingested": ingested, "errors": errors}
+
+@app.get("/bars/{symbol}")
+async def read_bars(symbol: str, timeframe: str = "D", start: Optional[datetime.date] = None, end: Optional[datetime.date] = None):
+    """Stored bars of `symbol` between the dates `start` and `end`, as columns. "time" is in seconds since epoch."""
+    parse_bar_symbols(symbol)
+    check_timeframe(timeframe)
+    start_time, end_time = time_range(start, end)
+
+    def query():
+        return to_columns(bar_store.query(timeframe, symbol, start_time, end_time))
+
+    loop = asyncio.get_running_loop()
+    bars = await loop.run_in_executor(None, query)
+    return bars_response({"symbol": symbol, "timeframe": timeframe, "bars": bars})
+
+@app.get("/bars")
+async def read_bars_of_symbols(symbols: Optional[str] = None, timeframe: str = "D", start: Optional[datetime.date] = None, end: Optional[datetime.date] = None):
+    """Same as /bars/{symbol} for many comma-separated symbols, or every stored symbol if none are given."""
+    check_timeframe(timeframe)
+    symbol_list = parse_bar_symbols(symbols) if symbols else bar_store.symbols(timeframe)
+    start_time, end_time = time_range(start, end)
+
+    def query():
+        return {symbol: to_columns(bar_store.query(timeframe, symbol, start_time, end_time)) for symbol in symbol_list}
+
+    loop = asyncio.get_running_loop()
+    bars = await loop.run_in_executor(None, query)
+    return bars_response({"timeframe": timeframe, "bars": bars})
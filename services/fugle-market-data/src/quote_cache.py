@@ -0,0 +1,101 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+# vim:fenc=utf-8
+#
+# TradeWiSE Project
+#
+# This file is part of the TradeWiSE project, an automated trading and financial analysis platform.
+# It is licensed under the Mozilla Public License 2.0 (MPL 2.0), which allows for wide use and modification
+# while ensuring that enhancements and modifications remain available to the community.
+#
+# You can find the MPL 2.0 license in the root directory of the project or at https://www.mozilla.org/MPL/2.0/.
+#
+# Copyright (c) 2023 by wildfootw <wildfootw@wildfoo.tw>
+#
+
+import asyncio
+import time
+from typing import Awaitable, Callable, Dict, Tuple
+
+
+class QuoteCache:
+    """
+    Per-symbol quote cache with single-flight loading.
+
+    Quotes are served from memory for `ttl` seconds. On a miss, concurrent requests for the same
+    symbol wait for one shared call to `fetch` instead of each calling the upstream API. The call
+    runs in a task of its own, so it completes for the other requests even if the request that
+    started it is cancelled. Failed fetches (results with an "error" key) are shared with the
+    waiting requests but not cached.
+    """
+    def __init__(self, fetch: Callable[[str], Awaitable[Dict]], ttl: float, max_entries: int = 5000):
+        self.fetch = fetch
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.upstream_calls = 0
+        self.upstream_errors = 0
+        self._entries: Dict[str, Tuple[float, Dict]] = {}
+        self._in_flight: Dict[str, asyncio.Task] = {}
+
+    def peek(self, symbol: str):
+        """Returns the cached quote of `symbol` if still fresh, else None. Does not count as a lookup."""
+        entry = self._entries.get(symbol)
+        if entry is not None and entry[0] > time.monotonic():
+            return entry[1]
+        return None
+
+    async def get(self, symbol: str) -> Dict:
+        quote = self.peek(symbol)
+        if quote is not None:
+            self.hits += 1
+            return quote
+
+        in_flight = self._in_flight.get(symbol)
+        if in_flight is not None:
+            self.coalesced += 1
+        else:
+            self.misses += 1
+            in_flight = asyncio.create_task(self._load(symbol))
+            self._in_flight[symbol] = in_flight
+            # Retrieved here so that a load nobody waits for anymore does not log its exception
+            in_flight.add_done_callback(lambda task: task.cancelled() or task.exception())
+        # A cancelled request, even the one that started the load, must not cancel the shared call
+        return await asyncio.shield(in_flight)
+
+    async def _load(self, symbol: str) -> Dict:
+        try:
+            self.upstream_calls += 1
+            quote = await self.fetch(symbol)
+        except Exception:
+            self.upstream_errors += 1
+            raise
+        finally:
+            del self._in_flight[symbol]
+        if "error" in quote:
+            self.upstream_errors += 1
+        else:
+            self._store(symbol, quote)
+        return quote
+
+    def _store(self, symbol: str, quote: Dict):
+        now = time.monotonic()
+        if len(self._entries) >= self.max_entries:
+            self._entries = {key: entry for key, entry in self._entries.items() if entry[0] > now}
+        self._entries[symbol] = (now + self.ttl, quote)
+
+    def stats(self) -> Dict:
+        lookups = self.hits + self.misses + self.coalesced
+        return {
+            "entries": len(self._entries),
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            # Requests answered without an upstream call of their own
+            "hit_ratio": (self.hits + self.coalesced) / lookups if lookups else 0.0,
+            "upstream_calls": self.upstream_calls,
+            "upstream_errors": self.upstream_errors,
+        }
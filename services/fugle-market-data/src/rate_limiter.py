@@ -0,0 +1,58 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+# vim:fenc=utf-8
+#
+# TradeWiSE Project
+#
+# This file is part of the TradeWiSE project, an automated trading and financial analysis platform.
+# It is licensed under the Mozilla Public License 2.0 (MPL 2.0), which allows for wide use and modification
+# while ensuring that enhancements and modifications remain available to the community.
+#
+# You can find the MPL 2.0 license in the root directory of the project or at https://www.mozilla.org/MPL/2.0/.
+#
+# Copyright (c) 2023 by wildfootw <wildfootw@wildfoo.tw>
+#
+# Identical copies live in services/fugle-market-data/src and services/fugle-trading/src, keep
+# them in sync. Each service image is built from its own directory and cannot import the other.
+
+import asyncio
+import logging
+import time
+from typing import Optional
+
+
+class TokenBucket:
+    """
+    Async token-bucket rate limiter.
+
+    Tokens are refilled continuously at `rate` per second up to `capacity`. Waiters are served in
+    arrival order, and sleeping never blocks the event loop.
+    """
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(rate, 1.0)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.waits = 0
+        self._lock: Optional[asyncio.Lock] = None
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self):
+        # The lock is created lazily so that it binds to the running event loop
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+
+        async with self._lock:
+            self._refill()
+            if self.tokens < 1:
+                self.waits += 1
+            while self.tokens < 1:
+                sleep_for = (1 - self.tokens) / self.rate
+                logging.debug(f"Rate limiter active, sleeping for {sleep_for} seconds")
+                await asyncio.sleep(sleep_for)
+                self._refill()
+            self.tokens -= 1
@@ -0,0 +1,208 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+# vim:fenc=utf-8
+#
+# TradeWiSE Project
+#
+# This file is part of the TradeWiSE project, an automated trading and financial analysis platform.
+# It is licensed under the Mozilla Public License 2.0 (MPL 2.0), which allows for wide use and modification
+# while ensuring that enhancements and modifications remain available to the community.
+#
+# You can find the MPL 2.0 license in the root directory of the project or at https://www.mozilla.org/MPL/2.0/.
+#
+# Copyright (c) 2023 by wildfootw <wildfootw@wildfoo.tw>
+#
+
+import asyncio
+import json
+import logging
+import time
+from array import array
+from typing import Dict, Optional, Set
+
+
+class TickRing:
+    """
+    The most recent `capacity` trades of a symbol, kept in fixed-size typed arrays: about 40 bytes
+    per tick instead of a dict each.
+    """
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.count = 0
+        self.time = array("q", bytes(8 * capacity))     # Exchange time, microseconds since epoch
+        self.price = array("d", bytes(8 * capacity))
+        self.size = array("q", bytes(8 * capacity))
+        self.bid = array("d", bytes(8 * capacity))
+        self.ask = array("d", bytes(8 * capacity))
+
+    def append(self, time_us: int, price: float, size: int, bid: float, ask: float):
+        i = self.count % self.capacity
+        self.time[i] = time_us
+        self.price[i] = price
+        self.size[i] = size
+        self.bid[i] = bid
+        self.ask[i] = ask
+        self.count += 1
+
+    def last(self, limit: int) -> Dict:
+        """Returns up to `limit` of the latest ticks as columns, oldest first."""
+        n = min(limit, self.count, self.capacity)
+        positions = [(self.count - n + k) % self.capacity for k in range(n)]
+        return {
+            "time": [self.time[i] for i in positions],
+            "price": [self.price[i] for i in positions],
+            "size": [self.size[i] for i in positions],
+            "bid": [self.bid[i] for i in positions],
+            "ask": [self.ask[i] for i in positions],
+        }
+
+class QuoteStream:
+    """
+    Live trades of the subscribed symbols from the Fugle WebSocket API.
+
+    Each symbol has a single upstream "trades" subscription, no matter how many consumers listen to
+    it. Every trade updates the latest quote and the tick ring of its symbol, and is put on the
+    queue of each consumer. A consumer that falls behind loses its oldest updates rather than
+    slowing down the others. The upstream subscription is dropped once its last consumer leaves,
+    the ring and the latest quote are kept.
+
+    The SDK client runs its own thread, its callbacks are handed over to the event loop.
+    """
+    def __init__(self, stock_client, ring_size: int = 4096, queue_size: int = 256):
+        self.stock = stock_client
+        self.ring_size = ring_size
+        self.queue_size = queue_size
+        self.latest: Dict[str, Dict] = {}
+        self.rings: Dict[str, TickRing] = {}
+        self.messages = 0
+        self.dropped = 0
+        self.latency_ms = {"last": None, "max": 0.0, "total": 0.0}
+        self._consumers: Dict[str, Set[asyncio.Queue]] = {}
+        self._channel_ids: Dict[str, str] = {}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._connected = False
+        self._connect_lock: Optional[asyncio.Lock] = None
+
+        self.stock.on("message", self._on_message)
+        self.stock.on("disconnect", self._on_disconnect)
+        self.stock.on("error", lambda error: logging.error(f"Quote stream error: {error}"))
+
+    async def _ensure_connected(self):
+        if self._connect_lock is None:
+            self._loop = asyncio.get_running_loop()
+            self._connect_lock = asyncio.Lock()
+        async with self._connect_lock:
+            if not self._connected:
+                await self._loop.run_in_executor(None, self.stock.connect)
+                self._connected = True
+                logging.info("Quote stream connected")
+
+    async def subscribe(self, symbol: str) -> asyncio.Queue:
+        """Returns a queue receiving the trades of `symbol` until `unsubscribe` is called."""
+        await self._ensure_connected()
+        queue = asyncio.Queue(maxsize=self.queue_size)
+        consumers = self._consumers.setdefault(symbol, set())
+        consumers.add(queue)
+        if len(consumers) == 1:
+            self.stock.subscribe({"channel": "trades", "symbol": symbol})
+            logging.info(f"Subscribed to trades of {symbol}")
+        return queue
+
+    def unsubscribe(self, symbol: str, queue: asyncio.Queue):
+        consumers = self._consumers.get(symbol)
+        if consumers is None:
+            return
+        consumers.discard(queue)
+        if not consumers:
+            del self._consumers[symbol]
+            channel_id = self._channel_ids.pop(symbol, None)
+            if channel_id is not None and self._connected:
+                self.stock.unsubscribe({"id": channel_id})
+                logging.info(f"Unsubscribed from trades of {symbol}")
+
+    def close(self):
+        if self._connected:
+            self._connected = False
+            self.stock.disconnect()
+
+    # Called on the SDK thread
+    def _on_message(self, raw_message):
+        received_at = time.time()
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._dispatch, raw_message, received_at)
+
+    def _on_disconnect(self, code=None, message=None):
+        logging.warning(f"Quote stream disconnected: {code} {message}")
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(lambda: self._loop.create_task(self._reconnect()))
+
+    async def _reconnect(self):
+        if not self._connected:
+            return
+        self._connected = False
+        self._channel_ids.clear()
+        delay = 1
+        while self._consumers:
+            try:
+                await self._ensure_connected()
+                for symbol in list(self._consumers):
+                    self.stock.subscribe({"channel": "trades", "symbol": symbol})
+                return
+            except Exception as e:
+                logging.error(f"Quote stream reconnect failed, retrying in {delay} seconds: {e}")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 60)
+
+    def _dispatch(self, raw_message, received_at: float):
+        message = json.loads(raw_message) if isinstance(raw_message, (str, bytes)) else raw_message
+        event = message.get("event")
+        data = message.get("data") or {}
+
+        if event == "subscribed":
+            symbol = data.get("symbol")
+            if symbol in self._consumers:
+                self._channel_ids[symbol] = data.get("id")
+            elif self._connected:
+                # The last consumer left before the subscription was confirmed
+                self.stock.unsubscribe({"id": data.get("id")})
+            return
+        if event != "data" or message.get("channel") != "trades" or "price" not in data:
+            return
+
+        symbol = data["symbol"]
+        self.messages += 1
+        time_us = int(data.get("time") or 0)
+        if time_us:
+            latency = received_at * 1000 - time_us / 1000
+            self.latency_ms["last"] = latency
+            self.latency_ms["max"] = max(self.latency_ms["max"], latency)
+            self.latency_ms["total"] += latency
+
+        data["receivedAt"] = received_at
+        self.latest[symbol] = data
+        ring = self.rings.get(symbol)
+        if ring is None:
+            ring = self.rings[symbol] = TickRing(self.ring_size)
+        ring.append(time_us, float(data["price"]), int(data.get("size") or 0),
+                    float(data.get("bid") or 0), float(data.get("ask") or 0))
+
+        for queue in self._consumers.get(symbol, ()):
+            if queue.full():
+                queue.get_nowait()
+                self.dropped += 1
+            queue.put_nowait(data)
+
+    def stats(self) -> Dict:
+        return {
+            "connected": self._connected,
+            "upstream_subscriptions": len(self._consumers),
+            "consumers": sum(len(consumers) for consumers in self._consumers.values()),
+            "messages": self.messages,
+            "dropped": self.dropped,
+            # From the exchange trade time to its arrival here
+            "latency_ms": {
+                "last": self.latency_ms["last"],
+                "max": self.latency_ms["max"],
+                "mean": self.latency_ms["total"] / self.messages if self.messages else None,
+            },
+        }
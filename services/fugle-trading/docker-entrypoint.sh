@@ -1,6 +1,7 @@
 #!/bin/sh
 
-export KEYRING_ENCRYPTION_KEY=$(python -c "from secrets import token_urlsafe; print(token_urlsafe(32))")
+# Set KEYRING_ENCRYPTION_KEY to keep the keyring file across restarts, a random key writes it anew every time
+export KEYRING_ENCRYPTION_KEY=${KEYRING_ENCRYPTION_KEY:-$(python -c "from secrets import token_urlsafe; print(token_urlsafe(32))")}
 
 # Remove the --reload flag in production
 uvicorn main:app --host 0.0.0.0 --port 80 --reload
@@ -0,0 +1,291 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+# vim:fenc=utf-8
+#
+# TradeWiSE Project
+#
+# This file is part of the TradeWiSE project, an automated trading and financial analysis platform.
+# It is licensed under the Mozilla Public License 2.0 (MPL 2.0), which allows for wide use and modification
+# while ensuring that enhancements and modifications remain available to the community.
+#
+# You can find the MPL 2.0 license in the root directory of the project or at https://www.mozilla.org/MPL/2.0/.
+#
+# Copyright (c) 2023 by wildfootw <wildfootw@wildfoo.tw>
+#
+from __future__ import annotations
+
+import asyncio
+import logging
+import threading
+import time
+from concurrent.futures import Executor
+from typing import Any, Callable, Optional
+
+_logger = logging.getLogger(__name__)
+
+
+def merge_order(order: dict, update: dict) -> dict:
+    """Returns `order` updated with the fields of `update`, never lowering the filled quantity."""
+    merged = {**order, **update}
+    if isinstance(order.get("mat_qty"), (int, float)) and isinstance(update.get("mat_qty"), (int, float)):
+        merged["mat_qty"] = max(order["mat_qty"], update["mat_qty"])
+    return merged
+
+
+def fill_key(fill: dict) -> tuple:
+    return (
+        fill.get("ord_no"),
+        fill.get("mat_time"),
+        _number(fill.get("mat_qty")),
+        _number(fill.get("mat_price")),
+    )
+
+
+def _number(value: Any) -> Any:
+    # The broker sends some numbers as text, "580.00"
+    if isinstance(value, str):
+        try:
+            return float(value)
+        except ValueError:
+            return value
+    return value
+
+
+def flatten_transactions(mat_sums: list[dict]) -> list[dict]:
+    """
+    Turns the summaries of `get_transactions`, which hold the fills under `mat_dats`, into fills
+    shaped like those of the websocket.
+    """
+    return [
+        {
+            "ord_no": detail.get("order_no"),
+            "stk_no": detail.get("stk_no", mat_sum.get("stk_no")),
+            "buy_sell": detail.get("buy_sell", mat_sum.get("buy_sell")),
+            "trade": detail.get("trade", mat_sum.get("trade")),
+            "mat_time": detail.get("t_time"),
+            "mat_qty": _number(detail.get("mat_qty")),
+            "mat_price": _number(detail.get("mat_price", detail.get("price"))),
+            "work_date": detail.get("t_date"),
+        }
+        for mat_sum in mat_sums
+        for detail in mat_sum.get("mat_dats") or []
+    ]
+
+
+class AccountSnapshot:
+    """
+    In-memory copy of the orders, fills, positions and balance of the account, so that reading them
+    does not need a broker round trip.
+
+    The snapshot is refreshed from two sources. The SDK's websocket pushes order acknowledgements
+    and fills as they happen. These are applied to the orders and fills right away, and the
+    positions and balance are fetched again `refresh_delay` seconds after a fill. Every
+    `reconcile_interval` seconds, everything is also fetched again in full, which repairs whatever
+    the websocket missed.
+
+    The SDK calls its callbacks on the websocket thread, and they are handed over to the event loop.
+    Every event is numbered, so that a full refresh keeps the events that arrived while it was
+    fetching, which the broker's answer may predate.
+    """
+
+    def __init__(
+        self,
+        get_sdk: Callable[[], Any],
+        executor: Optional[Executor] = None,
+        reconcile_interval: float = 60,
+        refresh_delay: float = 1,
+    ) -> None:
+        self.get_sdk = get_sdk
+        self.executor = executor
+        self.reconcile_interval = reconcile_interval
+        self.refresh_delay = refresh_delay
+        self.orders: dict[str, dict] = {}
+        self.fills: list[dict] = []
+        self.positions: dict[str, dict] = {}
+        self.balance: dict = {}
+        # Seconds since epoch of the last refresh of each part
+        self.updated_at: dict[str, Optional[float]] = {"orders": None, "fills": None, "positions": None, "balance": None}
+        self.events = 0
+        self.reconciliations = 0
+        self.websocket_connected = False
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._refresh_task: Optional[asyncio.Task] = None
+        self._holdings_stale = False
+        # Number of the last event, and the events since the last full refresh started
+        self._sequence = 0
+        self._order_events: dict[str, tuple[int, dict]] = {}
+        self._fill_events: list[tuple[int, dict]] = []
+        self._fill_keys: set[tuple] = set()
+        self._closed = False
+
+    async def run(self) -> None:
+        """Fetches the snapshot, subscribes to the websocket, then reconciles until cancelled."""
+        self._loop = asyncio.get_running_loop()
+        delay = 1
+        while True:
+            try:
+                await self.reconcile()
+                break
+            except Exception as e:
+                _logger.error(f"Failed to fetch the account snapshot, retrying in {delay} seconds: {e!r}")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 60)
+
+        self._start_websocket()
+        while True:
+            await asyncio.sleep(self.reconcile_interval)
+            try:
+                await self.reconcile()
+            except Exception as e:
+                _logger.error(f"Failed to reconcile the account snapshot: {e!r}")
+
+    def close(self) -> None:
+        self._closed = True
+
+    async def _call(self, func: Callable[[], Any]) -> Any:
+        # The SDK is blocking, keep it off the event loop
+        return await asyncio.get_running_loop().run_in_executor(self.executor, func)
+
+    async def reconcile(self) -> None:
+        """
+        Replaces the snapshot with what the broker reports, keeping the events that arrived while
+        fetching it.
+        """
+        start = self._sequence
+        orders, mat_sums = await asyncio.gather(
+            self._call(lambda: self.get_sdk().get_order_results()),
+            self._call(lambda: self.get_sdk().get_transactions("0d")),
+        )
+        fills = flatten_transactions(mat_sums)
+        await self.refresh_holdings()
+        now = time.time()
+
+        orders = {order["ord_no"]: order for order in orders}
+        for ord_no, (sequence, update) in self._order_events.items():
+            if sequence > start:
+                orders[ord_no] = merge_order(orders.get(ord_no, {}), update)
+        fetched = {fill_key(fill) for fill in fills}
+        fills += [
+            fill for sequence, fill in self._fill_events if sequence > start and fill_key(fill) not in fetched
+        ]
+
+        self._order_events = {
+            ord_no: event for ord_no, event in self._order_events.items() if event[0] > start
+        }
+        self._fill_events = [event for event in self._fill_events if event[0] > start]
+        self.orders = orders
+        self.fills = fills
+        self._fill_keys = {fill_key(fill) for fill in fills}
+        self.updated_at["orders"] = now
+        self.updated_at["fills"] = now
+        self.reconciliations += 1
+
+    async def refresh_holdings(self) -> None:
+        positions, balance = await asyncio.gather(
+            self._call(lambda: self.get_sdk().get_inventories()),
+            self._call(lambda: self.get_sdk().get_balance()),
+        )
+        now = time.time()
+        self.positions = {position["stk_no"]: position for position in positions}
+        self.balance = balance
+        self.updated_at["positions"] = now
+        self.updated_at["balance"] = now
+
+    def _start_websocket(self) -> None:
+        sdk = self.get_sdk()
+        sdk.on("order")(self._on_order)
+        sdk.on("dealt")(self._on_dealt)
+        sdk.on("error")(lambda error: _logger.error(f"Account websocket error: {error}"))
+        sdk.on("close")(self._on_close)
+
+        def connect():
+            # Blocks for as long as the connection lasts
+            self.websocket_connected = True
+            _logger.info("Account websocket connected")
+            try:
+                sdk.connect_websocket()
+            except Exception as e:
+                _logger.error(f"Account websocket failed: {e!r}")
+            finally:
+                self.websocket_connected = False
+                if not self._closed and self._loop is not None:
+                    self._loop.call_soon_threadsafe(self._reconnect_later)
+
+        threading.Thread(target=connect, name="fugle-account-websocket", daemon=True).start()
+
+    def _reconnect_later(self) -> None:
+        if self._closed:
+            return
+        _logger.warning("Account websocket closed, reconnecting in 5 seconds")
+        self._loop.call_later(5, self._start_websocket)
+
+    # Called on the websocket thread
+    def _on_order(self, message: dict) -> None:
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._apply_order, message)
+
+    def _on_dealt(self, message: dict) -> None:
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._apply_fill, message)
+
+    def _on_close(self, *args) -> None:
+        _logger.warning(f"Account websocket closed: {args[1:]}")
+
+    def _apply_order(self, message: dict) -> None:
+        order = message.get("data", message)
+        ord_no = order.get("ord_no")
+        if not ord_no:
+            return
+        self.events += 1
+        self._sequence += 1
+        self._record_order_event(ord_no, order)
+        self.orders[ord_no] = merge_order(self.orders.get(ord_no, {}), order)
+        self.updated_at["orders"] = time.time()
+
+    def _record_order_event(self, ord_no: str, update: dict) -> None:
+        _, updates = self._order_events.get(ord_no, (0, {}))
+        self._order_events[ord_no] = (self._sequence, merge_order(updates, update))
+
+    def _apply_fill(self, message: dict) -> None:
+        fill = message.get("data", message)
+        self.events += 1
+        # A reconcile may have fetched it before the websocket delivered it
+        key = fill_key(fill)
+        if key in self._fill_keys:
+            return
+        self._sequence += 1
+        self._fill_events.append((self._sequence, fill))
+        self._fill_keys.add(key)
+        self.fills.append(fill)
+        self.updated_at["fills"] = time.time()
+        ord_no = fill.get("ord_no")
+        order = self.orders.get(ord_no)
+        if order is not None and isinstance(order.get("mat_qty", 0), (int, float)) and isinstance(fill.get("mat_qty"), (int, float)):
+            order["mat_qty"] = order.get("mat_qty", 0) + fill["mat_qty"]
+            # The broker's answer to a refresh under way may not count this fill yet
+            self._record_order_event(ord_no, {"mat_qty": order["mat_qty"]})
+        # Positions and balance are the broker's numbers, fetch them once a burst of fills settles
+        self._holdings_stale = True
+        if self._refresh_task is None or self._refresh_task.done():
+            self._refresh_task = asyncio.ensure_future(self._refresh_after_fills())
+
+    async def _refresh_after_fills(self) -> None:
+        # Fills arriving during a fetch call for another one
+        while self._holdings_stale:
+            await asyncio.sleep(self.refresh_delay)
+            self._holdings_stale = False
+            try:
+                await self.refresh_holdings()
+            except Exception as e:
+                _logger.error(f"Failed to refresh positions and balance: {e!r}")
+
+    def stats(self) -> dict:
+        return {
+            "websocket_connected": self.websocket_connected,
+            "events": self.events,
+            "reconciliations": self.reconciliations,
+            "orders": len(self.orders),
+            "fills": len(self.fills),
+            "positions": len(self.positions),
+            "updated_at": self.updated_at,
+        }
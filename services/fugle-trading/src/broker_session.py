@@ -0,0 +1,170 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+# vim:fenc=utf-8
+#
+# TradeWiSE Project
+#
+# This file is part of the TradeWiSE project, an automated trading and financial analysis platform.
+# It is licensed under the Mozilla Public License 2.0 (MPL 2.0), which allows for wide use and modification
+# while ensuring that enhancements and modifications remain available to the community.
+#
+# You can find the MPL 2.0 license in the root directory of the project or at https://www.mozilla.org/MPL/2.0/.
+#
+# Copyright (c) 2023 by wildfootw <wildfootw@wildfoo.tw>
+#
+from __future__ import annotations
+
+import asyncio
+import functools
+import logging
+import threading
+import time
+from concurrent.futures import Executor
+from contextlib import contextmanager
+from typing import Any, Callable, Collection, Iterator, Optional
+
+_logger = logging.getLogger(__name__)
+
+
+class SessionExpired(Exception):
+    """The session expired during a call that is not repeated. It is logged in again."""
+
+
+class BrokerSession:
+    """
+    The logged-in SDK, set up in the background so that the service is up before the broker is.
+
+    `connect` builds the SDK and logs in, which takes seconds, so `run` calls it on `executor` after
+    the service has started, and again with backoff until it succeeds. Until then `ready` is False,
+    and `stats` tells the phase it is in and why the last attempt failed. `connect` wraps each of
+    its phases in `phase`, which records how long it took.
+
+    `get_sdk` returns a proxy of the SDK. When a call fails with an error that `is_expired`
+    recognizes as an expired session, the proxy logs in again and repeats the call once. Methods in
+    `not_repeated`, such as placing an order, may have reached the broker before the error, so they
+    are not repeated and raise `SessionExpired` after the login instead.
+    """
+
+    def __init__(
+        self,
+        connect: Callable[[BrokerSession], Any],
+        is_expired: Callable[[Exception], bool],
+        not_repeated: Collection[str] = (),
+        executor: Optional[Executor] = None,
+    ) -> None:
+        self.connect = connect
+        self.is_expired = is_expired
+        self.not_repeated = not_repeated
+        self.executor = executor
+        self.current_phase = "waiting"
+        self.error: Optional[str] = None
+        self.attempts = 0
+        self.relogins = 0
+        # Milliseconds spent in each phase of the last attempt
+        self.timings_ms: dict[str, float] = {}
+        # Seconds since epoch
+        self.created_at = time.time()
+        self.ready_at: Optional[float] = None
+        self._sdk: Any = None
+        self._proxy = _SessionProxy(self)
+        self._ready = asyncio.Event()
+        self._login_lock = threading.Lock()
+
+    @property
+    def ready(self) -> bool:
+        return self._sdk is not None
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        self.current_phase = name
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timings_ms[name] = (time.perf_counter() - start) * 1000
+
+    async def run(self) -> None:
+        """Connects, retrying until it succeeds."""
+        loop = asyncio.get_running_loop()
+        delay = 1
+        while True:
+            self.attempts += 1
+            self.timings_ms = {}
+            try:
+                sdk = await loop.run_in_executor(self.executor, self.connect, self)
+                break
+            except Exception as e:
+                self.error = repr(e)
+                _logger.error(f"Failed to connect to the broker in phase {self.current_phase}, retrying in {delay} seconds: {e!r}")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 60)
+
+        self._sdk = sdk
+        self.error = None
+        self.current_phase = "ready"
+        self.ready_at = time.time()
+        self._ready.set()
+        timings = ", ".join(f"{name} {ms:.0f} ms" for name, ms in self.timings_ms.items())
+        _logger.info(f"Connected to the broker {(self.ready_at - self.created_at) * 1000:.0f} ms after start: {timings}")
+
+    async def wait_ready(self) -> None:
+        await self._ready.wait()
+
+    def get_sdk(self) -> Any:
+        if self._sdk is None:
+            raise RuntimeError("Broker session not ready")
+        return self._proxy
+
+    def call(self, name: str, *args, **kwargs) -> Any:
+        """Calls the SDK method `name`, logging in again and repeating the call once if the session expired."""
+        relogins = self.relogins
+        try:
+            return getattr(self._sdk, name)(*args, **kwargs)
+        except Exception as e:
+            if not self.is_expired(e):
+                raise
+            _logger.warning(f"Session expired in {name}, logging in again: {e!r}")
+            if name in self.not_repeated:
+                self._relogin(relogins)
+                raise SessionExpired(f"Session expired in {name}, not repeated: {e}") from e
+        self._relogin(relogins)
+        return getattr(self._sdk, name)(*args, **kwargs)
+
+    def _relogin(self, relogins: int) -> None:
+        with self._login_lock:
+            # Calls that found the session expired at the same time share one login
+            if self.relogins != relogins:
+                return
+            with self.phase("relogin"):
+                self._sdk.login()
+            self.current_phase = "ready"
+            self.relogins += 1
+
+    def stats(self) -> dict:
+        return {
+            "ready": self.ready,
+            "phase": self.current_phase,
+            "attempts": self.attempts,
+            "error": self.error,
+            "timings_ms": self.timings_ms,
+            "ready_after_ms": (self.ready_at - self.created_at) * 1000 if self.ready_at is not None else None,
+            "relogins": self.relogins,
+        }
+
+
+class _SessionProxy:
+    """Calls the methods of the SDK through `BrokerSession.call`."""
+
+    def __init__(self, session: BrokerSession) -> None:
+        self._session = session
+
+    def __getattr__(self, name: str) -> Any:
+        attribute = getattr(self._session._sdk, name)
+        if not callable(attribute):
+            return attribute
+
+        @functools.wraps(attribute)
+        def call(*args, **kwargs):
+            return self._session.call(name, *args, **kwargs)
+
+        return call
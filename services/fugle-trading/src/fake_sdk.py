@@ -0,0 +1,210 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+# vim:fenc=utf-8
+#
+# TradeWiSE Project
+#
+# This file is part of the TradeWiSE project, an automated trading and financial analysis platform.
+# It is licensed under the Mozilla Public License 2.0 (MPL 2.0), which allows for wide use and modification
+# while ensuring that enhancements and modifications remain available to the community.
+#
+# You can find the MPL 2.0 license in the root directory of the project or at https://www.mozilla.org/MPL/2.0/.
+#
+# Copyright (c) 2023 by wildfootw <wildfootw@wildfoo.tw>
+#
+from __future__ import annotations
+
+import datetime
+import itertools
+import threading
+import time
+
+import fugle_trade.order
+
+
+class FakeSDK:
+    """
+    Stand-in for `fugle_trade.sdk.SDK` that never reaches the broker, for tests.
+
+    Every call sleeps `latency` seconds, like a broker round trip, and is safe to make from
+    several threads at once. Orders get sequential order numbers and are kept in `orders`. Each
+    order fills right away at its price, which updates the inventories and the balance, and its
+    acknowledgement and fill are pushed to the "order" and "dealt" callbacks. Fills are shaped as
+    the SDK's: flat on the websocket, and from `get_transactions` nested under `mat_dats` of a
+    summary per stock and side.
+
+    After `expire_session`, calls fail like those of an expired broker session until `login`. An
+    order placed then still counts in `place_order_calls`, as the broker may have received it.
+    After `hold_dealt`, fills are pushed to the "dealt" callback only on `release_dealt`, as when
+    the websocket lags behind the broker.
+    """
+
+    def __init__(self, latency: float = 0.05, balance: int = 10_000_000) -> None:
+        self.latency = latency
+        self.balance = balance
+        self.orders: list[dict] = []
+        self.fills: list[dict] = []
+        # Shares held of each stock
+        self.inventories: dict[str, int] = {}
+        self._callbacks: dict = {}
+        self._websocket_closed = threading.Event()
+        self._lock = threading.Lock()
+        self._order_numbers = itertools.count(1)
+        self.session_expired = False
+        self.logins = 0
+        self.place_order_calls = 0
+        self.holding_dealt = False
+        self._held_dealt: list[dict] = []
+
+    def login(self) -> None:
+        time.sleep(self.latency)
+        self.session_expired = False
+        self.logins += 1
+
+    def expire_session(self) -> None:
+        self.session_expired = True
+
+    def hold_dealt(self) -> None:
+        self.holding_dealt = True
+
+    def release_dealt(self) -> None:
+        with self._lock:
+            self.holding_dealt = False
+            held, self._held_dealt = self._held_dealt, []
+        for message in held:
+            self._push("dealt", message)
+
+    def _push(self, name: str, message: dict) -> None:
+        if name in self._callbacks:
+            self._callbacks[name](message)
+
+    def _check_session(self) -> None:
+        if self.session_expired:
+            raise RuntimeError("401 Unauthorized: token expired")
+
+    def stats(self) -> dict:
+        return {
+            "session_expired": self.session_expired,
+            "logins": self.logins,
+            "place_order_calls": self.place_order_calls,
+            "orders": len(self.orders),
+            "held_dealt": len(self._held_dealt),
+        }
+
+    def get_balance(self) -> dict:
+        time.sleep(self.latency)
+        self._check_session()
+        return {
+            "available_balance": self.balance,
+            "exange_balance": 0,
+            "stock_pre_save_amount": 0,
+            "is_latest_data": True,
+            "updated_at": int(time.time() * 1000),
+        }
+
+    def get_order_results(self) -> list[dict]:
+        time.sleep(self.latency)
+        self._check_session()
+        with self._lock:
+            return [dict(order) for order in self.orders]
+
+    def get_transactions(self, query_range: str) -> list[dict]:
+        time.sleep(self.latency)
+        self._check_session()
+        with self._lock:
+            mat_sums: dict[tuple, dict] = {}
+            for fill in self.fills:
+                mat_sum = mat_sums.setdefault((fill["stk_no"], fill["buy_sell"]), {
+                    "c_date": fill["work_date"],
+                    "stk_no": fill["stk_no"],
+                    "buy_sell": fill["buy_sell"],
+                    "trade": fill["trade"],
+                    "mat_qty": 0,
+                    "mat_dats": [],
+                })
+                mat_sum["mat_qty"] += fill["mat_qty"]
+                mat_sum["mat_dats"].append({
+                    "order_no": fill["ord_no"],
+                    "stk_no": fill["stk_no"],
+                    "buy_sell": fill["buy_sell"],
+                    "trade": fill["trade"],
+                    "t_date": fill["work_date"],
+                    "t_time": fill["mat_time"],
+                    "mat_qty": fill["mat_qty"],
+                    "mat_price": fill["mat_price"],
+                })
+            return list(mat_sums.values())
+
+    def get_inventories(self) -> list[dict]:
+        time.sleep(self.latency)
+        self._check_session()
+        with self._lock:
+            return [{"stk_no": stock_no, "qty_l": shares} for stock_no, shares in self.inventories.items() if shares]
+
+    def on(self, name: str):
+        def register(func):
+            self._callbacks[name] = func
+            return func
+        return register
+
+    def connect_websocket(self) -> None:
+        """Blocks like the SDK's websocket connection, until `close_websocket` is called."""
+        self._websocket_closed.clear()
+        self._websocket_closed.wait()
+
+    def close_websocket(self) -> None:
+        self._websocket_closed.set()
+
+    def place_order(self, order_object: fugle_trade.order.OrderObject) -> dict:
+        time.sleep(self.latency)
+        with self._lock:
+            self.place_order_calls += 1
+        self._check_session()
+        now = datetime.datetime.now()
+        with self._lock:
+            result = {
+                "ord_date": now.strftime("%Y%m%d"),
+                "ord_time": now.strftime("%H%M%S%f")[:9],
+                "ord_type": "2",
+                "ord_no": f"F{next(self._order_numbers):04d}",
+                "ret_code": "000000",
+                "ret_msg": "",
+                "work_date": now.strftime("%Y%m%d"),
+            }
+            order = {
+                **result,
+                "stock_no": order_object.stock_no,
+                "buy_sell": order_object.buy_sell.value,
+                "od_price": order_object.price,
+                "org_qty": order_object.quantity,
+                "mat_qty": order_object.quantity,
+                "ap_code": order_object.ap_code.value,
+            }
+            fill = {
+                "ord_no": result["ord_no"],
+                "stk_no": order_object.stock_no,
+                "ap_code": order_object.ap_code.value,
+                "buy_sell": order_object.buy_sell.value,
+                "trade": order_object.trade.value,
+                "mat_time": result["ord_time"],
+                "mat_qty": order_object.quantity,
+                "mat_price": order_object.price,
+                "work_date": result["work_date"],
+            }
+            self.orders.append(order)
+            self.fills.append(fill)
+            # Common and after-market orders are in board lots of 1000 shares
+            unit = 1000 if order_object.ap_code.value in ("1", "2") else 1
+            shares = order_object.quantity * unit * (1 if order_object.buy_sell.value == "B" else -1)
+            self.inventories[order_object.stock_no] = self.inventories.get(order_object.stock_no, 0) + shares
+            self.balance -= int(order_object.price * shares)
+
+        # The broker pushes these over the websocket, acknowledged before it fills
+        self._push("order", {"kind": "ACK", "data": {**order, "mat_qty": 0}})
+        dealt = {"kind": "MAT", "data": dict(fill)}
+        with self._lock:
+            if self.holding_dealt:
+                self._held_dealt.append(dealt)
+                return result
+        self._push("dealt", dealt)
+        return result
@@ -14,19 +14,32 @@
 #
 from __future__ import annotations
 
+import asyncio
+import hashlib
+import hmac
 import logging
 import os
+import re
+import threading
 from configparser import ConfigParser
+from contextlib import AbstractContextManager, asynccontextmanager, nullcontext
 from enum import Enum
 from pathlib import Path
+from typing import Callable
 
 import fugle_trade.constant
 import fugle_trade.order
 import keyring
-from fastapi import FastAPI
+import keyring.backend
+from account_snapshot import AccountSnapshot
+from broker_session import BrokerSession, SessionExpired
+from fake_sdk import FakeSDK
+from fastapi import FastAPI, HTTPException
 from fugle_trade.sdk import SDK
 from keyrings.cryptfile.cryptfile import CryptFileKeyring
+from order_pipeline import OrderPipeline
 from pydantic import BaseModel
+from rate_limiter import TokenBucket
 
 
 def get_env_or_raise(name: str) -> str:
@@ -35,10 +48,33 @@ def get_env_or_raise(name: str) -> str:
         raise ValueError(f'Environment variable "{name}" not set')
     return value
 
-fugle_trading_config_path = get_env_or_raise("FUGLE_TRADING_CONFIG")
-fugle_trading_account_password = get_env_or_raise("FUGLE_TRADING_PASSWORD")
-fugle_trading_cert_password = get_env_or_raise("FUGLE_TRADING_CERT_PASSWORD")
-keyring_encryption_key = get_env_or_raise("KEYRING_ENCRYPTION_KEY")
+# "fugle" trades through the broker, "fake" through FakeSDK, which needs none of the settings below
+fugle_trading_sdk = os.getenv("FUGLE_TRADING_SDK", "fugle")
+get_setting = get_env_or_raise if fugle_trading_sdk == "fugle" else os.getenv
+
+fugle_trading_config_path = get_setting("FUGLE_TRADING_CONFIG")
+fugle_trading_account_password = get_setting("FUGLE_TRADING_PASSWORD")
+fugle_trading_cert_password = get_setting("FUGLE_TRADING_CERT_PASSWORD")
+keyring_encryption_key = get_setting("KEYRING_ENCRYPTION_KEY")
+
+# Orders handed to the SDK at once, orders waiting for one of them, and seconds to wait for room in the queue
+ORDER_MAX_IN_FLIGHT = int(os.getenv("ORDER_MAX_IN_FLIGHT", "32"))
+ORDER_QUEUE_SIZE = int(os.getenv("ORDER_QUEUE_SIZE", "100"))
+ORDER_QUEUE_TIMEOUT = float(os.getenv("ORDER_QUEUE_TIMEOUT", "5"))
+# Orders sent to the broker per second, and how many may go out back to back
+ORDER_RATE_LIMIT = float(os.getenv("ORDER_RATE_LIMIT", "10"))
+ORDER_BURST = int(os.getenv("ORDER_BURST", "30"))
+# Most orders in one basket
+BASKET_MAX_LEGS = int(os.getenv("BASKET_MAX_LEGS", "100"))
+# Seconds between full refreshes of the account snapshot, and from a fill to refreshing positions and balance
+SNAPSHOT_RECONCILE_INTERVAL = float(os.getenv("SNAPSHOT_RECONCILE_INTERVAL", "60"))
+SNAPSHOT_REFRESH_DELAY = float(os.getenv("SNAPSHOT_REFRESH_DELAY", "1"))
+# Errors of the SDK that mean the session expired and a new login is needed, keep it narrow
+SESSION_EXPIRED_PATTERN = re.compile(os.getenv("SESSION_EXPIRED_PATTERN", r"(?i)\b401 unauthori[sz]ed\b|\btoken expired\b"))
+# Methods of the SDK that are not repeated after logging in again, as the broker may have acted on them
+NOT_REPEATED = {"place_order", "cancel_order", "delete_order", "modify_price"}
+# Seconds each call of FakeSDK takes
+FAKE_SDK_LATENCY = float(os.getenv("FAKE_SDK_LATENCY", "0.05"))
 
 _logger = logging.getLogger(__name__)
 logging.basicConfig(
@@ -49,9 +85,37 @@ logging.basicConfig(
 
 # --- Fugle trading client ---
 
+class MemoizedKeyring(keyring.backend.KeyringBackend):
+    """
+    Keeps the passwords of `backend` in memory once read or written. The encrypted file keyring
+    derives its key again on every access, which takes about a second.
+    """
+
+    priority = 1
+
+    def __init__(self, backend: keyring.backend.KeyringBackend, passwords: dict[tuple[str, str], str] | None = None) -> None:
+        super().__init__()
+        self.backend = backend
+        self._passwords = dict(passwords or {})
+
+    def get_password(self, service: str, username: str) -> str | None:
+        if (service, username) not in self._passwords:
+            self._passwords[service, username] = self.backend.get_password(service, username)
+        return self._passwords[service, username]
+
+    def set_password(self, service: str, username: str, password: str) -> None:
+        self.backend.set_password(service, username, password)
+        self._passwords[service, username] = password
+
+    def delete_password(self, service: str, username: str) -> None:
+        self.backend.delete_password(service, username)
+        self._passwords.pop((service, username), None)
+
 class FugleTrading:
     _singleton: FugleTrading | None = None
     _initailized: bool = False
+    # The first orders may arrive on several executor threads at once
+    _init_lock = threading.Lock()
 
     _sdk: SDK
 
@@ -72,43 +136,87 @@ class FugleTrading:
         keyring_key: str = keyring_encryption_key,
         account_password: str = fugle_trading_account_password,
         cert_password: str = fugle_trading_cert_password,
+        phase: Callable[[str], AbstractContextManager] = nullcontext,
     ) -> None:
-        if type(self)._initailized:
-            return
-        type(self)._initailized = True
-
-        config = ConfigParser()
-        if not config.read(config_path):
-            raise FileNotFoundError(f'Failed to read "{config_path}"')
-        # Resolve relative paths
-        config["Cert"]["Path"] = str(
-            Path(config_path).parent.joinpath(config["Cert"]["Path"]).resolve()
-        )
+        with type(self)._init_lock:
+            if type(self)._initailized:
+                return
+            self._setup(config_path, keyring_key, account_password, cert_password, phase)
+            type(self)._initailized = True
 
-        self.setup_crypt_file_keyring(keyring_key)
-        keyring.set_password("fugle_trade_sdk:account", config["User"]["Account"], account_password)
-        keyring.set_password("fugle_trade_sdk:cert", config["User"]["Account"], cert_password)
+    def _setup(
+        self,
+        config_path: str,
+        keyring_key: str,
+        account_password: str,
+        cert_password: str,
+        phase: Callable[[str], AbstractContextManager],
+    ) -> None:
+        with phase("config"):
+            config = ConfigParser()
+            if not config.read(config_path):
+                raise FileNotFoundError(f'Failed to read "{config_path}"')
+            # Resolve relative paths
+            config["Cert"]["Path"] = str(
+                Path(config_path).parent.joinpath(config["Cert"]["Path"]).resolve()
+            )
+
+        with phase("keyring"):
+            self.setup_crypt_file_keyring(keyring_key, config["User"]["Account"], account_password, cert_password)
+
+        with phase("sdk"):
+            self._sdk = SDK(config)
 
-        self._sdk = SDK(config)
-        self._sdk.login()
+        with phase("login"):
+            self._sdk.login()
 
     @staticmethod
-    def setup_crypt_file_keyring(keyring_key: str):
-        """Setup the keyring as a encrypted file-based keyring with a custom encryption key"""
+    def setup_crypt_file_keyring(keyring_key: str, account: str, account_password: str, cert_password: str):
+        """
+        Setup the keyring as a encrypted file-based keyring with a custom encryption key, holding the
+        passwords of `account`.
+
+        The file is kept across restarts as long as the key and the passwords stay the same, which
+        spares deriving the key to write them again.
+        """
 
         _logger.info("Setting up keyring")
 
-        kr = CryptFileKeyring()
+        passwords = {
+            ("fugle_trade_sdk:account", account): account_password,
+            ("fugle_trade_sdk:cert", account): cert_password,
+        }
+        # Tells whether the file holds these passwords under this key, without decrypting it
+        fingerprint = hmac.new(
+            keyring_key.encode(), "\0".join((account, account_password, cert_password)).encode(), hashlib.sha256
+        ).hexdigest()
 
-        # Ensure a fresh new keyring file
+        kr = CryptFileKeyring()
         kr_file_path = Path(kr.file_path)
-        if kr_file_path.exists():
-            kr_file_path.unlink()
-
-        kr.keyring_key = keyring_key
+        fingerprint_path = kr_file_path.with_name(kr_file_path.name + ".fingerprint")
+
+        reused = False
+        if kr_file_path.exists() and fingerprint_path.exists() and hmac.compare_digest(fingerprint_path.read_text(), fingerprint):
+            try:
+                kr.keyring_key = keyring_key
+                reused = True
+            except ValueError as e:
+                _logger.warning(f"Failed to unlock the keyring file: {e}")
+
+        if not reused:
+            # Ensure a fresh new keyring file
+            kr_file_path.unlink(missing_ok=True)
+            fingerprint_path.unlink(missing_ok=True)
+            kr = CryptFileKeyring()
+            kr.keyring_key = keyring_key
+            for (service, username), password in passwords.items():
+                kr.set_password(service, username, password)
+            fingerprint_path.write_text(fingerprint)
+
+        _logger.info("Reusing the keyring file" if reused else "Created a new keyring file")
 
         # set as the global keyring
-        keyring.set_keyring(kr)
+        keyring.set_keyring(MemoizedKeyring(kr, passwords))
 
 class Action(str, Enum):
     BUY = "buy"
@@ -230,14 +338,252 @@ class Order(BaseModel):
             trade=self.trade_type.to_fugle(),
         )
 
+    def shares(self) -> int:
+        """The quantity in shares, common and after-market orders count board lots of 1000 shares."""
+        if self.market in (Market.COMMON, Market.AFTER_MARKET):
+            return self.quantity * 1000
+        return self.quantity
+
+class Basket(BaseModel):
+    orders: list[Order]
+    all_or_nothing: bool = False
+    """Submit no order at all unless every order is valid and the cash buys are covered by the balance"""
+
 
 # --- FastAPI server ---
 
-app = FastAPI()
+fake_sdk = FakeSDK(latency=FAKE_SDK_LATENCY) if fugle_trading_sdk == "fake" else None
+
+def connect_broker(session: BrokerSession) -> SDK | FakeSDK:
+    # Runs on an executor thread, after the server started
+    if fake_sdk is not None:
+        with session.phase("login"):
+            fake_sdk.login()
+        return fake_sdk
+    FugleTrading(phase=session.phase)
+    return FugleTrading.sdk
+
+broker = BrokerSession(
+    connect_broker,
+    is_expired=lambda e: SESSION_EXPIRED_PATTERN.search(str(e)) is not None,
+    not_repeated=NOT_REPEATED,
+)
+
+def get_sdk() -> SDK | FakeSDK:
+    return broker.get_sdk()
+
+def require_broker() -> None:
+    if not broker.ready:
+        raise HTTPException(status_code=503, detail="Broker session not ready")
+
+def submit_order(order_object: fugle_trade.order.OrderObject):
+    # Runs on an executor thread of the pipeline
+    return get_sdk().place_order(order_object)
+
+order_pipeline = OrderPipeline(
+    submit_order,
+    max_in_flight=ORDER_MAX_IN_FLIGHT,
+    queue_size=ORDER_QUEUE_SIZE,
+    limiter=TokenBucket(rate=ORDER_RATE_LIMIT, capacity=ORDER_BURST),
+    uncertain=(SessionExpired,),
+)
+
+account_snapshot = AccountSnapshot(
+    get_sdk,
+    reconcile_interval=SNAPSHOT_RECONCILE_INTERVAL,
+    refresh_delay=SNAPSHOT_REFRESH_DELAY,
+)
+
+async def run_account_snapshot():
+    await broker.wait_ready()
+    await account_snapshot.run()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    order_pipeline.start()
+    broker_task = asyncio.create_task(broker.run())
+    snapshot_task = asyncio.create_task(run_account_snapshot())
+    yield
+    account_snapshot.close()
+    snapshot_task.cancel()
+    broker_task.cancel()
+    await order_pipeline.stop()
+
+app = FastAPI(lifespan=lifespan)
+
+@app.get("/health")
+async def health():
+    return {"status": "ok"}
+
+@app.get("/ready")
+async def read_readiness():
+    """200 once logged in to the broker, 503 until then, with the startup phase and its timings."""
+    stats = broker.stats()
+    if not broker.ready:
+        raise HTTPException(status_code=503, detail=stats)
+    return stats
 
 @app.post("/place_order")
-async def place_order(order: Order):
+async def place_order(order: Order, wait: bool = False):
+    """
+    Queues an order and returns its handle without waiting for the broker, unless `wait` is set.
+    The handle carries the status, the broker's result and the latency of each stage.
+    """
     try:
-        return FugleTrading.sdk.place_order(order.to_fugle())
+        order_object = order.to_fugle()
     except (ValueError, TypeError) as e:
         return {"error": str(e)}
+
+    require_broker()
+    handle = await order_pipeline.submit(order.model_dump(mode="json"), order_object, ORDER_QUEUE_TIMEOUT)
+    if handle is None:
+        raise HTTPException(status_code=503, detail="Order queue full")
+    if wait:
+        await handle.wait()
+    return handle.to_dict()
+
+@app.get("/place_order/{handle_id}")
+async def read_order_handle(handle_id: str):
+    handle = order_pipeline.get(handle_id)
+    if handle is None:
+        raise HTTPException(status_code=404, detail=f"Order {handle_id} not found")
+    return handle.to_dict()
+
+@app.get("/stats")
+async def read_stats():
+    stats = {**order_pipeline.stats(), "account": account_snapshot.stats(), "session": broker.stats()}
+    if fake_sdk is not None:
+        stats["fake_sdk"] = fake_sdk.stats()
+    return stats
+
+if fake_sdk is not None:
+    @app.post("/fake/expire_session")
+    async def expire_fake_session():
+        """Makes the session of FakeSDK expire, for tests."""
+        fake_sdk.expire_session()
+        return fake_sdk.stats()
+
+    @app.post("/fake/hold_dealt")
+    async def hold_fake_dealt():
+        """Holds the fills of FakeSDK back from the websocket until released, for tests."""
+        fake_sdk.hold_dealt()
+        return fake_sdk.stats()
+
+    @app.post("/fake/release_dealt")
+    async def release_fake_dealt():
+        fake_sdk.release_dealt()
+        return fake_sdk.stats()
+
+# --- Account snapshot, no broker round trip ---
+
+def snapshot_part(part: str):
+    """Returns when `part` of the snapshot was refreshed, failing with 503 if it was never loaded."""
+    updated_at = account_snapshot.updated_at[part]
+    if updated_at is None:
+        raise HTTPException(status_code=503, detail="Account snapshot not loaded yet")
+    return updated_at
+
+@app.get("/orders")
+async def read_orders():
+    """Orders of today, with their latest acknowledgement and filled quantity."""
+    return {"orders": list(account_snapshot.orders.values()), "updated_at": snapshot_part("orders")}
+
+@app.get("/orders/{ord_no}")
+async def read_order(ord_no: str):
+    updated_at = snapshot_part("orders")
+    order = account_snapshot.orders.get(ord_no)
+    if order is None:
+        raise HTTPException(status_code=404, detail=f"Order {ord_no} not found")
+    return {"order": order, "updated_at": updated_at}
+
+@app.get("/fills")
+async def read_fills():
+    """Fills of today."""
+    return {"fills": account_snapshot.fills, "updated_at": snapshot_part("fills")}
+
+@app.get("/positions")
+async def read_positions():
+    """Inventories as reported by the broker, with their cost and unrealized profit."""
+    return {"positions": list(account_snapshot.positions.values()), "updated_at": snapshot_part("positions")}
+
+@app.get("/positions/{stock_no}")
+async def read_position(stock_no: str):
+    updated_at = snapshot_part("positions")
+    position = account_snapshot.positions.get(stock_no)
+    if position is None:
+        raise HTTPException(status_code=404, detail=f"No position in {stock_no}")
+    return {"position": position, "updated_at": updated_at}
+
+@app.get("/balance")
+async def read_balance():
+    return {"balance": account_snapshot.balance, "updated_at": snapshot_part("balance")}
+
+@app.get("/portfolio")
+async def read_portfolio():
+    """Positions and balance in one read."""
+    return {
+        "positions": list(account_snapshot.positions.values()),
+        "balance": account_snapshot.balance,
+        "updated_at": min(snapshot_part("positions"), snapshot_part("balance")),
+    }
+
+async def check_balance(legs: list[Order]) -> str | None:
+    """Returns why the balance does not cover the cash buys of `legs` at their prices, or None if it does."""
+    cost = sum(leg.price * leg.shares() for leg in legs if leg.action == Action.BUY and leg.trade_type == TradeType.CASH)
+    if cost == 0:
+        return None
+    loop = asyncio.get_running_loop()
+    balance = await loop.run_in_executor(order_pipeline.executor, lambda: get_sdk().get_balance())
+    available = balance["available_balance"]
+    if cost > available:
+        return f"Cash buys cost {cost:.0f}, available balance is {available}"
+    return None
+
+@app.post("/place_basket")
+async def place_basket(basket: Basket, wait: bool = True):
+    """
+    Places many orders at once. Every order is validated before any is submitted, then the valid
+    ones are submitted concurrently through the order pipeline. Returns the result of each order in
+    the order given, as its handle or {"error": message}. With `all_or_nothing` no order is
+    submitted unless every order is valid and the balance covers the cash buys.
+    """
+    if not basket.orders:
+        raise HTTPException(status_code=400, detail="No orders given")
+    if len(basket.orders) > BASKET_MAX_LEGS:
+        raise HTTPException(status_code=400, detail=f"At most {BASKET_MAX_LEGS} orders per basket")
+    require_broker()
+
+    order_objects: list = []
+    errors: dict[int, str] = {}
+    for i, leg in enumerate(basket.orders):
+        try:
+            order_objects.append(leg.to_fugle())
+        except (ValueError, TypeError) as e:
+            order_objects.append(None)
+            errors[i] = str(e)
+
+    if basket.all_or_nothing:
+        if errors:
+            return {"submitted": False, "legs": [{"error": errors[i]} if i in errors else None for i in range(len(basket.orders))]}
+        try:
+            shortfall = await check_balance(basket.orders)
+        except Exception as e:
+            _logger.error(f"Failed to get the balance: {e!r}")
+            raise HTTPException(status_code=502, detail=f"Failed to get the balance: {e}")
+        if shortfall is not None:
+            return {"submitted": False, "error": shortfall, "legs": [None] * len(basket.orders)}
+
+    async def submit_leg(leg: Order, order_object):
+        handle = await order_pipeline.submit(leg.model_dump(mode="json"), order_object, ORDER_QUEUE_TIMEOUT)
+        if handle is None:
+            return {"error": "Order queue full"}
+        if wait:
+            await handle.wait()
+        return handle.to_dict()
+
+    valid = [i for i in range(len(basket.orders)) if i not in errors]
+    results = await asyncio.gather(*(submit_leg(basket.orders[i], order_objects[i]) for i in valid))
+    legs: list = [{"error": errors[i]} if i in errors else None for i in range(len(basket.orders))]
+    for i, result in zip(valid, results):
+        legs[i] = result
+    return {"submitted": True, "legs": legs}
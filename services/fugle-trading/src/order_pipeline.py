@@ -0,0 +1,202 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+# vim:fenc=utf-8
+#
+# TradeWiSE Project
+#
+# This file is part of the TradeWiSE project, an automated trading and financial analysis platform.
+# It is licensed under the Mozilla Public License 2.0 (MPL 2.0), which allows for wide use and modification
+# while ensuring that enhancements and modifications remain available to the community.
+#
+# You can find the MPL 2.0 license in the root directory of the project or at https://www.mozilla.org/MPL/2.0/.
+#
+# Copyright (c) 2023 by wildfootw <wildfootw@wildfoo.tw>
+#
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Optional
+
+from rate_limiter import TokenBucket
+
+_logger = logging.getLogger(__name__)
+
+
+class OrderHandle:
+    """An order accepted by the pipeline, followed from the queue to the broker's answer."""
+
+    def __init__(self, order: dict, order_object: Any) -> None:
+        self.id = uuid.uuid4().hex
+        self.order = order
+        self.order_object = order_object
+        self.status = "queued"
+        self.result: Any = None
+        self.error: Optional[str] = None
+        # Wall clock seconds since epoch
+        self.queued_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self._done = asyncio.get_running_loop().create_future()
+
+    async def wait(self) -> OrderHandle:
+        """Waits until the broker answered or the submission failed."""
+        await asyncio.shield(self._done)
+        return self
+
+    def _finish(self, status: str, result: Any = None, error: Optional[str] = None) -> None:
+        self.status = status
+        self.result = result
+        self.error = error
+        self.finished_at = time.time()
+        if not self._done.done():
+            self._done.set_result(None)
+
+    def latency_ms(self) -> dict:
+        def span(start: Optional[float], end: Optional[float]) -> Optional[float]:
+            return (end - start) * 1000 if start is not None and end is not None else None
+
+        return {
+            "queue": span(self.queued_at, self.started_at),
+            "broker": span(self.started_at, self.finished_at),
+            "total": span(self.queued_at, self.finished_at),
+        }
+
+    def to_dict(self) -> dict:
+        return {
+            "id": self.id,
+            "status": self.status,
+            "order": self.order,
+            "result": self.result,
+            "error": self.error,
+            "queued_at": self.queued_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "latency_ms": self.latency_ms(),
+        }
+
+
+class OrderPipeline:
+    """
+    Submits orders to the broker without blocking the event loop.
+
+    Orders wait on a bounded queue and `max_in_flight` workers hand them to `submit`, the blocking
+    SDK call, on a dedicated executor. All orders share the one logged-in SDK session, and leave the
+    queue no faster than `limiter` allows. When the queue is full, `submit` waits for room, which
+    pushes back on the callers.
+
+    An error of a type in `uncertain` leaves it unknown whether the broker got the order. Such an
+    order is not submitted again and its handle gets the status "unknown", the broker's list of
+    orders tells whether it went through.
+
+    Handles of the latest `max_handles` orders are kept for lookups.
+    """
+
+    def __init__(
+        self,
+        submit: Callable[[Any], Any],
+        max_in_flight: int = 4,
+        queue_size: int = 100,
+        max_handles: int = 10000,
+        limiter: Optional[TokenBucket] = None,
+        uncertain: tuple[type[Exception], ...] = (),
+    ) -> None:
+        self.submit_order = submit
+        self.limiter = limiter
+        self.uncertain = uncertain
+        self.max_in_flight = max_in_flight
+        self.max_handles = max_handles
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self.executor = ThreadPoolExecutor(max_workers=max_in_flight, thread_name_prefix="fugle-order")
+        self.in_flight = 0
+        self.submitted = 0
+        self.failed = 0
+        self.unknown = 0
+        self.rejected = 0
+        self.broker_ms = {"last": None, "max": 0.0, "total": 0.0}
+        self._handles: OrderedDict[str, OrderHandle] = OrderedDict()
+        self._tasks: list[asyncio.Task] = []
+
+    def start(self) -> None:
+        self._tasks = [asyncio.create_task(self._work()) for _ in range(self.max_in_flight)]
+
+    async def stop(self) -> None:
+        """Submits the orders still queued, then stops the workers."""
+        await self.queue.join()
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self.executor.shutdown(wait=True)
+
+    async def submit(self, order: dict, order_object: Any, timeout: float) -> Optional[OrderHandle]:
+        """
+        Queues an order and returns its handle right away, before the broker has seen it. Returns
+        None if the queue stayed full for `timeout` seconds.
+        """
+        handle = OrderHandle(order, order_object)
+        try:
+            await asyncio.wait_for(self.queue.put(handle), timeout)
+        except asyncio.TimeoutError:
+            self.rejected += 1
+            return None
+        self._handles[handle.id] = handle
+        while len(self._handles) > self.max_handles:
+            self._handles.popitem(last=False)
+        return handle
+
+    def get(self, handle_id: str) -> Optional[OrderHandle]:
+        return self._handles.get(handle_id)
+
+    async def _work(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            handle = await self.queue.get()
+            if self.limiter is not None:
+                await self.limiter.acquire()
+            self.in_flight += 1
+            handle.status = "submitting"
+            handle.started_at = time.time()
+            try:
+                result = await loop.run_in_executor(self.executor, self.submit_order, handle.order_object)
+                handle._finish("submitted", result=result)
+                self.submitted += 1
+            except self.uncertain as e:
+                _logger.error(f"Order {handle.id} may or may not have reached the broker: {e!r}")
+                handle._finish("unknown", error=str(e))
+                self.unknown += 1
+            except Exception as e:
+                _logger.error(f"Failed to place order {handle.id}: {e!r}")
+                handle._finish("failed", error=str(e))
+                self.failed += 1
+            finally:
+                self.in_flight -= 1
+                self.queue.task_done()
+            broker_ms = handle.latency_ms()["broker"]
+            self.broker_ms["last"] = broker_ms
+            self.broker_ms["max"] = max(self.broker_ms["max"], broker_ms)
+            self.broker_ms["total"] += broker_ms
+
+    def stats(self) -> dict:
+        done = self.submitted + self.failed + self.unknown
+        return {
+            "max_in_flight": self.max_in_flight,
+            "in_flight": self.in_flight,
+            "queued": self.queue.qsize(),
+            "queue_size": self.queue.maxsize,
+            "submitted": self.submitted,
+            "failed": self.failed,
+            "unknown": self.unknown,
+            "rejected": self.rejected,
+            "rate_limited": self.limiter.waits if self.limiter is not None else 0,
+            # Time of the SDK call, from leaving the queue to the broker's answer
+            "broker_ms": {
+                "last": self.broker_ms["last"],
+                "max": self.broker_ms["max"],
+                "mean": self.broker_ms["total"] / done if done else None,
+            },
+        }
@@ -13,15 +13,25 @@
 # Copyright (c) 2023 by wildfootw <wildfootw@wildfoo.tw>
 #
 
-import json
-
+import orjson
 from bson import ObjectId
-from fastapi.encoders import jsonable_encoder
+from bson.decimal128 import Decimal128
+from fastapi.responses import JSONResponse
+
+
+def default(obj):
+    # orjson handles datetime, dict, list and int subclasses such as Int64 natively
+    if isinstance(obj, ObjectId):
+        return str(obj)  # Convert ObjectId to string for JSON serialization
+    if isinstance(obj, Decimal128):
+        return str(obj)
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
 
+def encode_json(content) -> bytes:
+    """Encodes a MongoDB document straight to JSON bytes, in a single pass."""
+    return orjson.dumps(content, default=default, option=orjson.OPT_NON_STR_KEYS)
 
-# Custom JSON Encoder for handling ObjectId
-class JSONEncoder(json.JSONEncoder):
-    def default(self, obj):
-        if isinstance(obj, ObjectId):
-            return str(obj)  # Convert ObjectId to string for JSON serialization
-        return super(JSONEncoder, self).default(obj)
+class MongoJSONResponse(JSONResponse):
+    """JSON response for raw MongoDB documents, skipping FastAPI's jsonable_encoder pass."""
+    def render(self, content) -> bytes:
+        return encode_json(content)
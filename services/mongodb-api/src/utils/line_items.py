@@ -0,0 +1,189 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+# vim:fenc=utf-8
+#
+# TradeWiSE Project
+#
+# This file is part of the TradeWiSE project, an automated trading and financial analysis platform.
+# It is licensed under the Mozilla Public License 2.0 (MPL 2.0), which allows for wide use and modification
+# while ensuring that enhancements and modifications remain available to the community.
+#
+# You can find the MPL 2.0 license in the root directory of the project or at https://www.mozilla.org/MPL/2.0/.
+#
+# Copyright (c) 2023 by wildfootw <wildfootw@wildfoo.tw>
+#
+
+"""
+Columnar storage of report line items.
+
+The crawler sends a report as a flat dict of account name to amount, with "" for the section
+headers. It is stored as parallel arrays instead:
+
+    accounts:        [account code, ...]     line items in report order
+    amounts:         [Int64, ...]            amount of each line item, in thousands of NTD
+    section_accounts [account code, ...]     section headers
+    section_offsets  [int, ...]              index in `accounts` of the first item of each section
+
+Account names are interned once in the shared `account_codes` collection, so a report no longer
+repeats the long Chinese keys, and a multikey index on `accounts` finds every report holding a
+given account.
+
+Amounts that are not whole numbers (e.g. earnings per share, in NTD) are kept as doubles, and
+amounts that are not numeric at all as strings. Missing amounts are stored as null.
+"""
+
+import asyncio
+import logging
+import re
+from typing import Dict, Iterable, List, Optional
+
+from bson.int64 import Int64
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+LINE_ITEM_FORMAT = "columnar"
+
+_RE_INT = re.compile(r"^[\-\+]?[0-9]+$")
+_RE_FLOAT = re.compile(r"^[\-\+]?([0-9]+\.?[0-9]*|\.[0-9]+)([eE][\-\+]?[0-9]+)?$")
+
+class AccountDictionary:
+    """
+    Interned account names, shared by all report types.
+
+    Codes are allocated from a counter document and the names are unique in the collection, so
+    concurrent API instances agree on the code of every account. Known codes are cached in memory.
+    """
+    def __init__(self, collection, counters):
+        self.collection = collection
+        self.counters = counters
+        self.codes: Dict[str, int] = {}
+        self.names: Dict[int, str] = {}
+        self._lock = asyncio.Lock()
+
+    async def load(self):
+        await self.collection.create_index("name", unique=True)
+        async for doc in self.collection.find({}):
+            self._remember(doc["name"], doc["_id"])
+        logging.info(f"Loaded {len(self.codes)} account codes")
+
+    def _remember(self, name: str, code: int):
+        self.codes[name] = code
+        self.names[code] = name
+
+    async def intern(self, names: Iterable[str]) -> Dict[str, int]:
+        """Returns the codes of the given account names, allocating codes for new ones."""
+        missing = list(dict.fromkeys(name for name in names if name not in self.codes))
+        if missing:
+            async with self._lock:
+                missing = [name for name in missing if name not in self.codes]
+                if missing:
+                    await self._allocate(missing)
+        return self.codes
+
+    async def _allocate(self, names: List[str]):
+        counter = await self.counters.find_one_and_update(
+            {"_id": "account_codes"},
+            {"$inc": {"seq": len(names)}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        )
+        first_code = counter["seq"] - len(names) + 1
+        for code, name in enumerate(names, start=first_code):
+            try:
+                await self.collection.insert_one({"_id": code, "name": name})
+                self._remember(name, code)
+            except DuplicateKeyError:
+                # Another instance interned the same name first, the allocated code stays unused
+                doc = await self.collection.find_one({"name": name})
+                self._remember(name, doc["_id"])
+
+    async def lookup(self, name: str) -> Optional[int]:
+        """Returns the code of an account name, or None when no report has that account."""
+        if name not in self.codes:
+            doc = await self.collection.find_one({"name": name})
+            if doc is None:
+                return None
+            self._remember(name, doc["_id"])
+        return self.codes[name]
+
+    async def resolve(self, codes: Iterable[int]) -> Dict[int, str]:
+        """Returns the account names of the given codes, including the ones interned elsewhere."""
+        missing = [code for code in set(codes) if code not in self.names]
+        if missing:
+            async for doc in self.collection.find({"_id": {"$in": missing}}):
+                self._remember(doc["name"], doc["_id"])
+        return self.names
+
+def amount_expression(code: int) -> Dict:
+    """Aggregation expression reading the amount of an account out of a columnar document, or null."""
+    return {"$let": {
+        "vars": {"i": {"$indexOfArray": [{"$ifNull": ["$accounts", []]}, code]}},
+        "in": {"$cond": [{"$lt": ["$$i", 0]}, None, {"$arrayElemAt": ["$amounts", "$$i"]}]},
+    }}
+
+def is_section_header(value) -> bool:
+    return value == "" or value is None
+
+def encode_amount(value):
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, int):
+        return Int64(value)
+    if isinstance(value, float):
+        if value != value:
+            return None
+        return Int64(value) if value.is_integer() else value
+    if isinstance(value, str):
+        text = value.replace(",", "").strip()
+        if _RE_INT.match(text):
+            return Int64(int(text))
+        if _RE_FLOAT.match(text):
+            return encode_amount(float(text))
+    return value
+
+async def encode_line_items(line_items: Dict, accounts: AccountDictionary) -> Dict:
+    """Converts a dict of account name to amount into the columnar fields of a report document."""
+    codes = await accounts.intern(line_items)
+
+    document = {
+        "format": LINE_ITEM_FORMAT,
+        "accounts": [],
+        "amounts": [],
+        "section_accounts": [],
+        "section_offsets": [],
+    }
+    for name, value in line_items.items():
+        if is_section_header(value):
+            document["section_accounts"].append(codes[name])
+            document["section_offsets"].append(len(document["accounts"]))
+        else:
+            document["accounts"].append(codes[name])
+            document["amounts"].append(encode_amount(value))
+    return document
+
+async def decode_line_items(document: Dict, accounts: AccountDictionary) -> Dict:
+    """
+    Rebuilds the flat dict of account name to amount of a columnar report document, with "" for
+    the section headers. Other fields of the document are kept as is.
+    """
+    if document.get("format") != LINE_ITEM_FORMAT:
+        # Stored before the columnar format
+        return document
+
+    account_codes = document.pop("accounts")
+    amounts = document.pop("amounts")
+    section_accounts = document.pop("section_accounts")
+    section_offsets = document.pop("section_offsets")
+    del document["format"]
+
+    names = await accounts.resolve(account_codes + section_accounts)
+    sections = list(zip(section_offsets, section_accounts))
+    s = 0
+    for i, (code, amount) in enumerate(zip(account_codes, amounts)):
+        while s < len(sections) and sections[s][0] <= i:
+            document[names[sections[s][1]]] = ""
+            s += 1
+        document[names[code]] = int(amount) if isinstance(amount, Int64) else amount
+    for _, code in sections[s:]:
+        document[names[code]] = ""
+    return document
@@ -0,0 +1,211 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+# vim:fenc=utf-8
+#
+# TradeWiSE Project
+#
+# This file is part of the TradeWiSE project, an automated trading and financial analysis platform.
+# It is licensed under the Mozilla Public License 2.0 (MPL 2.0), which allows for wide use and modification
+# while ensuring that enhancements and modifications remain available to the community.
+#
+# You can find the MPL 2.0 license in the root directory of the project or at https://www.mozilla.org/MPL/2.0/.
+#
+# Copyright (c) 2023 by wildfootw <wildfootw@wildfoo.tw>
+#
+
+import asyncio
+import datetime
+import hashlib
+import logging
+import sqlite3
+import threading
+import time
+import zlib
+from pathlib import Path
+from typing import Dict, Optional
+
+# Deadlines for listed companies to file their quarterly reports, as (months after the season, day).
+# Q4 reports are due by the end of March of the following year.
+FILING_DEADLINES = {1: (5, 15), 2: (8, 14), 3: (11, 14), 4: (15, 31)}
+
+# Page MOPS returns when it has no report for the period
+NO_DATA_MESSAGE = "查無所需資料！"
+
+def is_period_closed(year, season, today: Optional[datetime.date] = None) -> bool:
+    """
+    Returns True once the filing deadline of the given ROC year and season has passed, after which
+    the published report is not expected to change anymore.
+    """
+    today = today or datetime.date.today()
+    month, day = FILING_DEADLINES[int(season)]
+    deadline_year = int(year) + 1911 + (month - 1) // 12
+    deadline = datetime.date(deadline_year, (month - 1) % 12 + 1, day)
+    return today > deadline
+
+class ReportCache:
+    """
+    Persistent, size-bounded cache of raw MOPS responses keyed by (report_type, co_id, year, season).
+
+    Bodies are zlib-compressed and stored under the SHA-256 of their content, so identical pages
+    (e.g. every "查無所需資料！" response) are only kept once. The SQLite index keeps per-entry
+    expiry and last access time: closed periods never expire, open periods expire after
+    `open_period_ttl` seconds, and the least recently used entries are evicted once the stored
+    bodies exceed `max_bytes`. No-data pages expire after `no_data_ttl` seconds whatever the
+    period, as a report filed late or added by MOPS afterwards must be fetched again.
+    """
+    def __init__(self, cache_dir: str, max_bytes: int, open_period_ttl: float, no_data_ttl: float):
+        self.cache_dir = Path(cache_dir)
+        self.objects_dir = self.cache_dir / "objects"
+        self.objects_dir.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.open_period_ttl = open_period_ttl
+        self.no_data_ttl = no_data_ttl
+        self.hits = 0
+        self.misses = 0
+
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(str(self.cache_dir / "index.sqlite3"), check_same_thread=False)
+        self._db.executescript("""
+            CREATE TABLE IF NOT EXISTS entries (
+                report_type TEXT NOT NULL,
+                co_id       TEXT NOT NULL,
+                year        INTEGER NOT NULL,
+                season      INTEGER NOT NULL,
+                digest      TEXT NOT NULL,
+                stored_at   REAL NOT NULL,
+                expires_at  REAL,
+                last_access REAL NOT NULL,
+                PRIMARY KEY (report_type, co_id, year, season)
+            );
+            CREATE INDEX IF NOT EXISTS entries_last_access ON entries (last_access);
+            CREATE INDEX IF NOT EXISTS entries_digest ON entries (digest);
+            CREATE TABLE IF NOT EXISTS objects (
+                digest TEXT PRIMARY KEY,
+                size   INTEGER NOT NULL
+            );
+        """)
+        self._db.commit()
+
+    def _object_path(self, digest: str) -> Path:
+        return self.objects_dir / digest[:2] / f"{digest}.zlib"
+
+    def get(self, report_type, co_id, year, season, allow_expired=False) -> Optional[str]:
+        key = (report_type, str(co_id), int(year), int(season))
+        now = time.time()
+        with self._lock:
+            row = self._db.execute(
+                "SELECT digest, expires_at FROM entries"
+                " WHERE report_type = ? AND co_id = ? AND year = ? AND season = ?", key
+            ).fetchone()
+            if row is None or (not allow_expired and row[1] is not None and row[1] <= now):
+                self.misses += 1
+                return None
+
+            try:
+                body = self._object_path(row[0]).read_bytes()
+            except FileNotFoundError:
+                logging.warning(f"Cached body {row[0]} is missing, dropping entry {key}")
+                self._delete_entry(key)
+                self._db.commit()
+                self.misses += 1
+                return None
+
+            self._db.execute(
+                "UPDATE entries SET last_access = ?"
+                " WHERE report_type = ? AND co_id = ? AND year = ? AND season = ?", (now,) + key
+            )
+            self._db.commit()
+            self.hits += 1
+
+        return zlib.decompress(body).decode("utf-8")
+
+    def put(self, report_type, co_id, year, season, text: str):
+        key = (report_type, str(co_id), int(year), int(season))
+        body = zlib.compress(text.encode("utf-8"), 6)
+        digest = hashlib.sha256(body).hexdigest()
+        now = time.time()
+        if NO_DATA_MESSAGE in text:
+            expires_at = now + self.no_data_ttl
+        elif is_period_closed(year, season):
+            expires_at = None
+        else:
+            expires_at = now + self.open_period_ttl
+
+        with self._lock:
+            path = self._object_path(digest)
+            if not path.exists():
+                path.parent.mkdir(exist_ok=True)
+                tmp_path = path.with_suffix(".tmp")
+                tmp_path.write_bytes(body)
+                tmp_path.replace(path)
+            self._db.execute("INSERT OR IGNORE INTO objects (digest, size) VALUES (?, ?)", (digest, len(body)))
+
+            self._delete_entry(key, keep_digest=digest)
+            self._db.execute(
+                "INSERT INTO entries (report_type, co_id, year, season, digest, stored_at, expires_at, last_access)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?)", key + (digest, now, expires_at, now)
+            )
+            self._evict()
+            self._db.commit()
+
+    def _delete_entry(self, key, keep_digest: Optional[str] = None):
+        row = self._db.execute(
+            "SELECT digest FROM entries WHERE report_type = ? AND co_id = ? AND year = ? AND season = ?", key
+        ).fetchone()
+        if row is None:
+            return
+        self._db.execute("DELETE FROM entries WHERE report_type = ? AND co_id = ? AND year = ? AND season = ?", key)
+        if row[0] != keep_digest:
+            self._release_object(row[0])
+
+    def _release_object(self, digest: str):
+        # Remove the body once no entry references it anymore
+        if self._db.execute("SELECT 1 FROM entries WHERE digest = ? LIMIT 1", (digest,)).fetchone():
+            return
+        self._db.execute("DELETE FROM objects WHERE digest = ?", (digest,))
+        try:
+            self._object_path(digest).unlink()
+        except FileNotFoundError:
+            pass
+
+    def _total_bytes(self) -> int:
+        return self._db.execute("SELECT COALESCE(SUM(size), 0) FROM objects").fetchone()[0]
+
+    def _evict(self):
+        total_bytes = self._total_bytes()
+        if total_bytes <= self.max_bytes:
+            return
+
+        evicted = 0
+        cursor = self._db.execute(
+            "SELECT report_type, co_id, year, season FROM entries ORDER BY last_access"
+        ).fetchall()
+        for key in cursor:
+            if total_bytes <= self.max_bytes:
+                break
+            self._delete_entry(tuple(key))
+            total_bytes = self._total_bytes()
+            evicted += 1
+        logging.info(f"Evicted {evicted} cache entries, {total_bytes} bytes remaining")
+
+    def stats(self) -> Dict:
+        with self._lock:
+            entries = self._db.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+            objects, total_bytes = self._db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM objects").fetchone()
+        return {
+            "entries": entries,
+            "objects": objects,
+            "bytes": total_bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+    # The index and bodies live on disk, so keep the blocking work off the event loop
+    async def aget(self, report_type, co_id, year, season, allow_expired=False) -> Optional[str]:
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(None, self.get, report_type, co_id, year, season, allow_expired)
+
+    async def aput(self, report_type, co_id, year, season, text: str):
+        loop = asyncio.get_event_loop()
+        await loop.run_in_executor(None, self.put, report_type, co_id, year, season, text)
@@ -0,0 +1,127 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+# vim:fenc=utf-8
+#
+# TradeWiSE Project
+#
+# This file is part of the TradeWiSE project, an automated trading and financial analysis platform.
+# It is licensed under the Mozilla Public License 2.0 (MPL 2.0), which allows for wide use and modification
+# while ensuring that enhancements and modifications remain available to the community.
+#
+# You can find the MPL 2.0 license in the root directory of the project or at https://www.mozilla.org/MPL/2.0/.
+#
+# Copyright (c) 2023 by wildfootw <wildfootw@wildfoo.tw>
+#
+
+import asyncio
+import logging
+import time
+from typing import Dict, Optional
+
+import aiohttp
+
+# URLs for different types of financial reports
+REPORT_URLS = {
+    "balance_sheet":    "https://mops.twse.com.tw/mops/web/ajax_t164sb03",
+    "income_statement": "https://mops.twse.com.tw/mops/web/ajax_t164sb04",
+    "cash_flow":        "https://mops.twse.com.tw/mops/web/ajax_t164sb05"
+}
+
+HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:120.0) Gecko/20100101 Firefox/120.0'
+}
+
+class TokenBucket:
+    """
+    Async token-bucket rate limiter.
+
+    Tokens are refilled continuously at `rate` per second up to `capacity`. Waiters are served in
+    arrival order, and sleeping never blocks the event loop.
+    """
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(rate, 1.0)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock: Optional[asyncio.Lock] = None
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self):
+        # The lock is created lazily so that it binds to the running event loop
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+
+        async with self._lock:
+            self._refill()
+            while self.tokens < 1:
+                sleep_for = (1 - self.tokens) / self.rate
+                logging.debug(f"Rate limiter active, sleeping for {sleep_for} seconds")
+                await asyncio.sleep(sleep_for)
+                self._refill()
+            self.tokens -= 1
+
+class MopsFetcher:
+    """
+    Fetches raw financial report pages from MOPS over a single pooled, keep-alive HTTP session.
+
+    Every request goes through the shared token bucket, so the MOPS rate budget holds no matter how
+    many report requests are queued.
+    """
+    def __init__(self, calls_per_second: float, max_connections: int, timeout: float):
+        self.limiter = TokenBucket(calls_per_second)
+        self.max_connections = max_connections
+        self.timeout = timeout
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    async def start(self):
+        if self._session is not None:
+            return
+        connector = aiohttp.TCPConnector(limit=self.max_connections, ttl_dns_cache=300, keepalive_timeout=60)
+        self._session = aiohttp.ClientSession(
+            connector=connector,
+            headers=HEADERS,
+            timeout=aiohttp.ClientTimeout(total=self.timeout),
+        )
+        logging.info(f"MOPS fetcher started with {self.max_connections} pooled connections")
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def fetch(self, ticker_symbol: str, report_type: str, year, season) -> Dict:
+        url = REPORT_URLS[report_type]
+        if self._session is None:
+            await self.start()
+
+        form_data = {
+            'encodeURIComponent': 1,
+            'step': 1,
+            'firstin': 1,
+            'off': 1,
+            'co_id': ticker_symbol,
+            'year': year,
+            'season': season,
+        }
+
+        await self.limiter.acquire()
+        logging.debug(f"Starting request for {url}, ticker: {ticker_symbol}, year: {year}, season: {season}")
+        try:
+            async with self._session.post(url, data=form_data) as response:
+                logging.debug(f"Received response for {url}, status: {response.status}")
+                if response.status != 200:
+                    logging.warning(f"Failed to retrieve data: Status code {response.status}")
+                    return {"status_code": response.status, "message": "Failed to retrieve data"}
+
+                return {"status_code": 200, "data": await response.text()}
+
+        except asyncio.TimeoutError:
+            logging.error(f"Request timed out for {url}, ticker: {ticker_symbol}, year: {year}, season: {season}")
+            return {"status_code": 504, "message": "Request to MOPS timed out"}
+        except aiohttp.ClientError as e:
+            logging.error(f"Request error: {e}")
+            return {"status_code": 500, "message": "Internal Server Error"}
@@ -13,124 +13,87 @@
 # Copyright (c) 2023 by wildfootw <wildfootw@wildfoo.tw>
 #
 
-import functools
+import asyncio
+import itertools
+import json
 import logging
 import os
-import time
-from io import StringIO
+from contextlib import asynccontextmanager
+from typing import List
 
-import pandas
-import requests
+from cache import ReportCache
 from fastapi import FastAPI, HTTPException
+from fastapi.responses import StreamingResponse
+from fetcher import MopsFetcher
+from parse_pool import ParsePool
+from parsers import LATEST_VERSIONS, sanitize_report
 from pydantic import BaseModel
 
 # Set up logging
 log_level = os.environ.get("LOG_LEVEL", "DEBUG").upper()
 logging.basicConfig(level=log_level, format="%(asctime)s %(levelname)s %(message)s")
 
-class RateLimiter:
-    def __init__(self, calls_per_second):
-        self.period = 1.0 / calls_per_second
-        self.last_called = time.monotonic()
-
-    def wait(self):
-        current = time.monotonic()
-        sleep_for = self.last_called + self.period - current
-        if sleep_for > 0:
-            logging.debug(f"Rate limiter active, sleeping for {sleep_for} seconds")
-            time.sleep(sleep_for)
-        self.last_called = time.monotonic()
-        logging.debug("Rate limiter lock released")
-
-def rate_limited(func):
-    # Use functools.wraps to preserve metadata of the original function
-    @functools.wraps(func)
-    def wrapped(*args, **kwargs):
-        limiter.wait()
-        # Call the original function and return its result
-        return func(*args, **kwargs)
-    return wrapped
-
-limiter = RateLimiter(calls_per_second=10)
-app = FastAPI()
-
-@rate_limited
-def crawl_financial_report(ticker_symbol, report_type, year, season):
-    # URLs for different types of financial reports
-    report_urls = {
-        "balance_sheet":    "https://mops.twse.com.tw/mops/web/ajax_t164sb03",
-        "income_statement": "https://mops.twse.com.tw/mops/web/ajax_t164sb04",
-        "cash_flow":        "https://mops.twse.com.tw/mops/web/ajax_t164sb05"
-    }
-    url = report_urls[report_type]
-
-    logging.debug(f"Starting request for {url}, ticker: {ticker_symbol}, year: {year}, season: {season}")
-
-    form_data = {
-        'encodeURIComponent': 1,
-        'step': 1,
-        'firstin': 1,
-        'off': 1,
-        'co_id': ticker_symbol,
-        'year': year,
-        'season': season,
-    }
-    headers = {
-        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:120.0) Gecko/20100101 Firefox/120.0'
-    }
-    try:
-        response = requests.post(url, data=form_data, headers=headers)
-        logging.debug(f"Received response for {url}, status: {response.status_code}")
-        if response.status_code != 200:
-            logging.warning(f"Failed to retrieve data: Status code {response.status_code}")
-            return {"status_code": response.status_code, "message": "Failed to retrieve data"}
-
-        return {"status_code": 200, "data": response.text}
-
-    except requests.RequestException as e:
-        logging.error(f"Request error: {e}")
-        return {"status_code": 500, "message": "Internal Server Error"}
-
-# Listed companies, OTC (Over-the-Counter) companies, and emerging stock companies have started to adopt IFRSs (International Financial Reporting Standards) for financial statement preparation since 2013.
-def sanitize_balance_sheet_ifrs(year, season, response_text):
-    if "查無所需資料！" in response_text:
-        logging.info("No data found for the given parameters.")
-        return {"status_code": 200, "data": {"version": "NDF"}}
-
-    if "Too many query requests from your ip" in response_text:
-        logging.info("Request frequency exceeded the allowed limit.")
-        return {"status_code": 429, "message": "Request frequency exceeded the allowed limit"}
-
-    try:
-        html_dataframe = pandas.read_html(StringIO(response_text))[1].fillna("")
-
-        # Season to date mapping
-        season_to_date = {1: "03月31日", 2: "06月30日", 3: "09月30日", 4: "12月31日"}
-        date_col = f"{year}年{season_to_date[season]}"
-
-        # Construct column names based on year and season
-        year_season_col = f"民國{year}年第{season}季"
-
-        # Change column name according to DataFrame structure
-        key_col_name = html_dataframe[year_season_col]["單位：新台幣仟元"]["會計項目"].columns[0]
-
-        # Selecting the key and value columns
-        keys = html_dataframe[year_season_col]["單位：新台幣仟元"]["會計項目"][key_col_name]
-        values = html_dataframe[year_season_col]["單位：新台幣仟元"][date_col]["金額"]
-
-        # Creating a dictionary from the selected columns
-        data_dict = dict(zip(keys, values))
-        return {"status_code": 200, "data": data_dict}
-
-    except ValueError as e:
-        logging.error(f"Data parsing error with pandas: {e}")
-        return {"status_code": 500, "message": "Error parsing HTML data"}
-    except KeyError as e:
-        logging.error(f"Key error in data extraction, possible incorrect DataFrame indexing: {e}")
-        return {"status_code": 500, "message": "Key error in data extraction"}
-    except Exception as e:
-        logging.error(f"Unexpected error in data extraction: {e}")
-        return {"status_code": 500, "message": "Unknown error occurred in data extraction"}
+# MOPS fetch engine configuration
+MOPS_CALLS_PER_SECOND = float(os.environ.get("MOPS_CALLS_PER_SECOND", "10"))
+MOPS_MAX_CONNECTIONS = int(os.environ.get("MOPS_MAX_CONNECTIONS", "10"))
+MOPS_REQUEST_TIMEOUT = float(os.environ.get("MOPS_REQUEST_TIMEOUT", "30"))
+BATCH_CONCURRENCY = int(os.environ.get("BATCH_CONCURRENCY", "20"))
+
+# Raw response cache configuration, an empty MOPS_CACHE_DIR disables the cache
+MOPS_CACHE_DIR = os.environ.get("MOPS_CACHE_DIR", "/var/cache/mops-crawler")
+MOPS_CACHE_MAX_BYTES = int(os.environ.get("MOPS_CACHE_MAX_BYTES", str(2 * 1024 ** 3)))
+MOPS_CACHE_OPEN_PERIOD_TTL = float(os.environ.get("MOPS_CACHE_OPEN_PERIOD_TTL", str(6 * 60 * 60)))
+MOPS_CACHE_NO_DATA_TTL = float(os.environ.get("MOPS_CACHE_NO_DATA_TTL", str(24 * 60 * 60)))
+
+# Parse stage configuration, PARSE_WORKERS=0 parses on the event loop
+PARSE_WORKERS = int(os.environ.get("PARSE_WORKERS", str(os.cpu_count() or 1)))
+PARSE_QUEUE_DEPTH = int(os.environ.get("PARSE_QUEUE_DEPTH", str(2 * max(PARSE_WORKERS, 1))))
+
+REPORT_TYPES = list(LATEST_VERSIONS)
+
+fetcher = MopsFetcher(
+    calls_per_second=MOPS_CALLS_PER_SECOND,
+    max_connections=MOPS_MAX_CONNECTIONS,
+    timeout=MOPS_REQUEST_TIMEOUT,
+)
+
+cache = ReportCache(
+    cache_dir=MOPS_CACHE_DIR,
+    max_bytes=MOPS_CACHE_MAX_BYTES,
+    open_period_ttl=MOPS_CACHE_OPEN_PERIOD_TTL,
+    no_data_ttl=MOPS_CACHE_NO_DATA_TTL,
+) if MOPS_CACHE_DIR else None
+
+parse_pool = ParsePool(workers=PARSE_WORKERS, queue_depth=PARSE_QUEUE_DEPTH, log_level=log_level)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # One keep-alive session is shared by every request for the lifetime of the app
+    await fetcher.start()
+    parse_pool.start()
+    yield
+    parse_pool.close()
+    await fetcher.close()
+
+app = FastAPI(lifespan=lifespan)
+
+async def crawl_financial_report(ticker_symbol, report_type, year, season, cache_only=False):
+    """
+    Returns the raw report page, served from the response cache when possible. With `cache_only`
+    the page is never fetched from MOPS, and expired entries are still served, which allows
+    reparsing the cached pages with a new parser version without any network traffic. Fetched pages
+    are left to the caller to cache once they parse.
+    """
+    if cache is not None:
+        cached_text = await cache.aget(report_type, ticker_symbol, year, season, allow_expired=cache_only)
+        if cached_text is not None:
+            logging.debug(f"Cache hit for {report_type}, ticker: {ticker_symbol}, year: {year}, season: {season}")
+            return {"status_code": 200, "data": cached_text, "cached": True}
+
+    if cache_only:
+        return {"status_code": 404, "message": "Report not found in cache"}
+
+    return await fetcher.fetch(ticker_symbol, report_type, year, season)
 
 # Function to generate the POST data
 def generate_post_data(ticker_symbol, year, season, data):
@@ -145,47 +108,126 @@ def generate_post_data(ticker_symbol, year, season, data):
         post_data["version"] = "v1"
     return post_data
 
-def sanitize_report(report_type, year, season, response_text):
-    if report_type == "balance_sheet":
-        return sanitize_balance_sheet_ifrs(year, season, response_text)
-    elif report_type == "income_statement":
-        # return sanitize_income_statement(response_text, year, season)
-        pass
-    elif report_type == "cash_flow":
-        # return sanitize_cash_flow(response_text, year, season)
-        pass
-
 # Function to process each report
-def process_report(ticker_symbol, report_type, year, season):
+async def process_report(ticker_symbol, report_type, year, season, cache_only=False):
     logging.info(f"Processing report for ticker {ticker_symbol}, year: {year}, season: {season}, type: {report_type}")
 
     # Retrieve the financial report data
-    report_result = crawl_financial_report(ticker_symbol, report_type, year, season)
+    report_result = await crawl_financial_report(ticker_symbol, report_type, year, season, cache_only)
     if report_result.get("status_code") != 200:
         return report_result  # This will contain the status_code and message from crawl_financial_report
 
-    sanitized_report = sanitize_report(report_type, year, season, report_result["data"])
+    sanitized_report = await parse_pool.run(sanitize_report, report_type, year, season, report_result["data"])
     if sanitized_report.get("status_code") != 200:
         return sanitized_report  # This will contain the status_code and message from sanitize_report
 
+    # Only pages that parsed or tell there is no report are cached, an error page may not expire
+    if cache is not None and not report_result.get("cached"):
+        await cache.aput(report_type, ticker_symbol, year, season, report_result["data"])
+
     # Generate POST data with the sanitized report data
     post_data = generate_post_data(ticker_symbol, year, season, sanitized_report["data"])
 
     logging.info(f"Completed data extraction for {ticker_symbol}, year: {year}, season: {season}")
     return {"status_code": 200, "message": "Success", "data": post_data}
 
+class Period(BaseModel):
+    year: int
+    season: int
+
+class BatchRequest(BaseModel):
+    ticker_symbols: List[str]
+    report_types: List[str]
+    periods: List[Period]
+    cache_only: bool = False
+
+async def stream_batch(jobs, concurrency, cache_only=False):
+    """
+    Runs every (ticker_symbol, report_type, year, season) job with a bounded pool of workers and
+    yields one NDJSON line per job as soon as it finishes. The MOPS rate budget is still enforced
+    by the fetcher's token bucket, the workers only bound how many jobs are in flight at once.
+    """
+    results = asyncio.Queue()
+    jobs = iter(jobs)
+
+    async def worker():
+        for ticker_symbol, report_type, year, season in jobs:
+            try:
+                result = await process_report(ticker_symbol, report_type, year, season, cache_only)
+            except Exception as e:
+                logging.error(f"Unexpected error in batch job {ticker_symbol} {report_type} {year} {season}: {e}")
+                result = {"status_code": 500, "message": "Internal Server Error"}
+
+            line = {
+                "ticker_symbol": ticker_symbol,
+                "report_type": report_type,
+                "year": year,
+                "season": season,
+                "status_code": result["status_code"],
+            }
+            if result["status_code"] == 200:
+                line["data"] = result["data"]
+            else:
+                line["message"] = result["message"]
+            await results.put(json.dumps(line, ensure_ascii=False) + "\n")
+
+        # Signal that this worker ran out of jobs
+        await results.put(None)
+
+    workers = [asyncio.ensure_future(worker()) for _ in range(concurrency)]
+    finished = 0
+    try:
+        while finished < len(workers):
+            line = await results.get()
+            if line is None:
+                finished += 1
+                continue
+            yield line
+    finally:
+        # Stop crawling if the client went away before the batch completed
+        for task in workers:
+            task.cancel()
+
+@app.post("/batch")
+async def batch_financial_reports(batch_request: BatchRequest):
+    invalid_types = [t for t in batch_request.report_types if t not in REPORT_TYPES]
+    if invalid_types:
+        raise HTTPException(status_code=400, detail=f"Invalid report type specified: {invalid_types}")
+
+    jobs = itertools.product(
+        batch_request.ticker_symbols,
+        batch_request.report_types,
+        [(period.year, period.season) for period in batch_request.periods],
+    )
+    jobs = ((ticker_symbol, report_type, year, season) for ticker_symbol, report_type, (year, season) in jobs)
+    total = len(batch_request.ticker_symbols) * len(batch_request.report_types) * len(batch_request.periods)
+    logging.info(f"Starting batch of {total} reports")
+
+    return StreamingResponse(stream_batch(jobs, min(BATCH_CONCURRENCY, max(total, 1)), batch_request.cache_only), media_type="application/x-ndjson")
+
 @app.get("/health")
-def health_check():
+async def health_check():
     return {"Hello": "World"}
 
+@app.get("/cache/stats")
+async def cache_stats():
+    if cache is None:
+        raise HTTPException(status_code=404, detail="Response cache is disabled")
+    loop = asyncio.get_event_loop()
+    return await loop.run_in_executor(None, cache.stats)
+
+@app.get("/parse_pool/stats")
+async def parse_pool_stats():
+    return parse_pool.stats()
+
 @app.get("/{ticker_symbol}/{report_type}/{year}/{season}")
-def get_financial_report(report_type: str, ticker_symbol: str, year: int, season: int):
+async def get_financial_report(report_type: str, ticker_symbol: str, year: int, season: int, cache_only: bool = False):
     # Ensure that report_type is one of the expected types
-    if report_type not in ["balance_sheet", "income_statement", "cash_flow"]:
+    if report_type not in REPORT_TYPES:
         raise HTTPException(status_code=400, detail="Invalid report type specified")
 
     # Call the process_report function with the path parameters
-    result = process_report(ticker_symbol, report_type, year, season)
+    result = await process_report(ticker_symbol, report_type, year, season, cache_only)
 
     # If process_report returned an error status code, raise an HTTPException
     if result["status_code"] != 200:
@@ -0,0 +1,87 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+# vim:fenc=utf-8
+#
+# TradeWiSE Project
+#
+# This file is part of the TradeWiSE project, an automated trading and financial analysis platform.
+# It is licensed under the Mozilla Public License 2.0 (MPL 2.0), which allows for wide use and modification
+# while ensuring that enhancements and modifications remain available to the community.
+#
+# You can find the MPL 2.0 license in the root directory of the project or at https://www.mozilla.org/MPL/2.0/.
+#
+# Copyright (c) 2023 by wildfootw <wildfootw@wildfoo.tw>
+#
+
+import asyncio
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional
+
+
+def init_worker(log_level):
+    logging.basicConfig(level=log_level, format="%(asctime)s %(levelname)s [parser] %(message)s")
+
+class ParsePool:
+    """
+    Runs the CPU-bound HTML parsing on a process pool, apart from the event loop doing the fetches.
+
+    At most `workers + queue_depth` parse jobs are submitted at once. Callers with a fetched page
+    wait for a free slot before moving on to their next fetch, so the fetched pages waiting in
+    memory are bounded by the number of callers, while the fetches themselves are bounded only by
+    the fetcher. With `workers` set to 0 the jobs run inline on the event loop.
+    """
+    def __init__(self, workers: int, queue_depth: int, log_level: str = "INFO"):
+        self.workers = workers
+        self.queue_depth = queue_depth
+        self.log_level = log_level
+        self.in_flight = 0
+        self.waiting = 0
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._slots: Optional[asyncio.Semaphore] = None
+
+    def start(self):
+        self._slots = asyncio.Semaphore(max(self.workers, 1) + self.queue_depth)
+        if self.workers > 0:
+            # Spawned workers only import the parsers, not the app and its open sessions
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=init_worker,
+                initargs=(self.log_level,),
+            )
+        logging.info(f"Parse pool started with {self.workers} workers and queue depth {self.queue_depth}")
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+    async def run(self, func, *args):
+        if self._slots is None:
+            self.start()
+
+        # Fetched pages waiting for a slot
+        self.waiting += 1
+        try:
+            await self._slots.acquire()
+        finally:
+            self.waiting -= 1
+        self.in_flight += 1
+        try:
+            if self._executor is None:
+                return func(*args)
+            loop = asyncio.get_event_loop()
+            return await loop.run_in_executor(self._executor, func, *args)
+        finally:
+            self.in_flight -= 1
+            self._slots.release()
+
+    def stats(self):
+        return {
+            "workers": self.workers,
+            "queue_depth": self.queue_depth,
+            "waiting": self.waiting,
+            "in_flight": self.in_flight,
+        }
@@ -0,0 +1,112 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+# vim:fenc=utf-8
+#
+# TradeWiSE Project
+#
+# This file is part of the TradeWiSE project, an automated trading and financial analysis platform.
+# It is licensed under the Mozilla Public License 2.0 (MPL 2.0), which allows for wide use and modification
+# while ensuring that enhancements and modifications remain available to the community.
+#
+# You can find the MPL 2.0 license in the root directory of the project or at https://www.mozilla.org/MPL/2.0/.
+#
+# Copyright (c) 2023 by wildfootw <wildfootw@wildfoo.tw>
+#
+
+import logging
+
+from table_parser import read_table
+
+# Parsers keyed by (report_type, version), and the version used for new reports of each type
+PARSERS = {}
+LATEST_VERSIONS = {}
+
+UNIT_COL = "單位：新台幣仟元"
+KEY_COL = "會計項目"
+AMOUNT_COL = "金額"
+
+# Season to date mapping
+SEASON_TO_DATE = {1: "03月31日", 2: "06月30日", 3: "09月30日", 4: "12月31日"}
+
+def register_parser(report_type, version):
+    """Registers the decorated function as the parser of `version` of `report_type` reports."""
+    def decorator(func):
+        PARSERS[(report_type, version)] = func
+        LATEST_VERSIONS[report_type] = version
+        return func
+    return decorator
+
+def extract_line_items(response_text, year, season, period_cols):
+    """
+    Reads the report table of a MOPS page into a dict of account name to amount, taking the amount
+    from the first of `period_cols` found in the header. The page is parsed once and only the two
+    selected columns are converted.
+    """
+    table = read_table(response_text, 1)
+
+    # Construct column names based on year and season
+    year_season_col = f"民國{year}年第{season}季"
+
+    # Locate the account name and amount columns in the table header
+    key_col = table.find_column(year_season_col, UNIT_COL, KEY_COL)
+    for period_col in period_cols:
+        value_col = table.find_column(year_season_col, UNIT_COL, period_col, AMOUNT_COL)
+        if value_col is not None:
+            break
+    if key_col is None or value_col is None or len(table.columns[value_col]) != 4:
+        raise KeyError(f"Columns of {year_season_col} {period_cols} not found in table header")
+
+    # Creating a dictionary from the selected columns
+    return dict(zip(table.column(key_col), table.column(value_col)))
+
+# Listed companies, OTC (Over-the-Counter) companies, and emerging stock companies have started to adopt IFRSs (International Financial Reporting Standards) for financial statement preparation since 2013.
+@register_parser("balance_sheet", "v1")
+def parse_balance_sheet_ifrs(year, season, response_text):
+    # Balances at the end of the season
+    return extract_line_items(response_text, year, season, [f"{year}年{SEASON_TO_DATE[season]}"])
+
+@register_parser("income_statement", "v1")
+def parse_income_statement_ifrs(year, season, response_text):
+    # Amounts of the season itself, Q4 is only reported for the whole year
+    period_cols = [f"{year}年第{season}季"]
+    if season == 4:
+        period_cols.insert(0, f"{year}年度")
+    return extract_line_items(response_text, year, season, period_cols)
+
+@register_parser("cash_flow", "v1")
+def parse_cash_flow_ifrs(year, season, response_text):
+    # Cash flows are reported year to date
+    period_cols = [f"{year}年01月01日至{year}年{SEASON_TO_DATE[season]}"]
+    if season == 4:
+        period_cols.insert(0, f"{year}年度")
+    return extract_line_items(response_text, year, season, period_cols)
+
+def sanitize_report(report_type, year, season, response_text, version=None):
+    version = version or LATEST_VERSIONS.get(report_type)
+    parser = PARSERS.get((report_type, version))
+    if parser is None:
+        logging.error(f"No parser registered for {report_type} version {version}")
+        return {"status_code": 400, "message": f"Unsupported report type or version: {report_type} {version}"}
+
+    if "查無所需資料！" in response_text:
+        logging.info("No data found for the given parameters.")
+        return {"status_code": 200, "data": {"version": "NDF"}}
+
+    if "Too many query requests from your ip" in response_text:
+        logging.info("Request frequency exceeded the allowed limit.")
+        return {"status_code": 429, "message": "Request frequency exceeded the allowed limit"}
+
+    try:
+        data_dict = parser(year, season, response_text)
+        data_dict["version"] = version
+        return {"status_code": 200, "data": data_dict}
+
+    except ValueError as e:
+        logging.error(f"Data parsing error: {e}")
+        return {"status_code": 500, "message": "Error parsing HTML data"}
+    except KeyError as e:
+        logging.error(f"Key error in data extraction, possible incorrect table header: {e}")
+        return {"status_code": 500, "message": "Key error in data extraction"}
+    except Exception as e:
+        logging.error(f"Unexpected error in data extraction: {e}")
+        return {"status_code": 500, "message": "Unknown error occurred in data extraction"}
@@ -0,0 +1,276 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+# vim:fenc=utf-8
+#
+# TradeWiSE Project
+#
+# This file is part of the TradeWiSE project, an automated trading and financial analysis platform.
+# It is licensed under the Mozilla Public License 2.0 (MPL 2.0), which allows for wide use and modification
+# while ensuring that enhancements and modifications remain available to the community.
+#
+# You can find the MPL 2.0 license in the root directory of the project or at https://www.mozilla.org/MPL/2.0/.
+#
+# Copyright (c) 2023 by wildfootw <wildfootw@wildfoo.tw>
+#
+
+"""
+Streaming extraction of a single HTML table from a MOPS report page.
+
+`pandas.read_html` parses every table of the page into a DataFrame just for us to keep one of them
+and read two of its columns. This module stops the lxml parser as soon as the wanted table is
+complete and converts only the requested columns, while following the same rules as
+`pandas.read_html(...)[index].fillna("")` (table selection, header detection, colspan/rowspan
+expansion, whitespace cleanup, thousands separators and numeric inference), so the extracted
+values are identical to the ones the pandas based parser produced.
+"""
+
+import re
+from io import BytesIO
+from typing import List, Optional, Tuple
+
+from lxml import etree
+
+# Same whitespace cleanup as pandas.io.html
+_RE_WHITESPACE = re.compile(r"[\r\n]+|\s{2,}")
+# pandas.read_html only considers tables containing at least one text node matching this pattern
+_RE_TABLE_MATCH = re.compile(".+")
+# Numbers with "," thousands separators, as recognized by the pandas python parser
+_RE_THOUSANDS = re.compile(r"^[\-\+]?([0-9]+,|[0-9])*(\.[0-9]*)?([0-9]?(E|e)\-?[0-9]+)?$")
+_RE_INT = re.compile(r"^\s*[\-\+]?[0-9]+\s*$")
+_RE_FLOAT = re.compile(
+    r"^\s*[\-\+]?(([0-9]+\.?[0-9]*|\.[0-9]+)([eE][\-\+]?[0-9]+)?|inf|infinity|nan)\s*$", re.IGNORECASE
+)
+# pandas default NA markers
+_NA_VALUES = frozenset([
+    "", "#N/A", "#N/A N/A", "#NA", "-1.#IND", "-1.#QNAN", "-NaN", "-nan", "1.#IND", "1.#QNAN",
+    "<NA>", "N/A", "NA", "NULL", "NaN", "None", "n/a", "nan", "null",
+])
+
+_string_value = etree.XPath("string()")
+_styled_elements = etree.XPath(".//*[@style]")
+_tbody_rows = etree.XPath(".//tbody//tr")
+_tfoot_rows = etree.XPath(".//tfoot//tr")
+_text_nodes = etree.XPath(".//text()")
+
+def _remove_whitespace(text: str) -> str:
+    return _RE_WHITESPACE.sub(" ", text.strip())
+
+def _cell_text(cell) -> str:
+    # Padding of ragged rows is already text
+    if isinstance(cell, str):
+        return cell
+    return _remove_whitespace(_string_value(cell))
+
+def _cells(tr) -> list:
+    return [child for child in tr if child.tag == "td" or child.tag == "th"]
+
+def _is_hidden(element) -> bool:
+    return "display:none" in element.get("style", "").replace(" ", "")
+
+def _is_listed(table) -> bool:
+    if _is_hidden(table):
+        return False
+    return any(_RE_TABLE_MATCH.search(text) for text in _text_nodes(table))
+
+def find_table(response_text: str, index: int):
+    """
+    Returns the `index`-th table element of the page, counted the way `pandas.read_html` counts
+    them. Parsing stops right after that table is complete.
+    """
+    context = etree.iterparse(
+        BytesIO(response_text.encode("utf-8")),
+        events=("start", "end"),
+        tag="table",
+        html=True,
+        encoding="utf-8",
+        recover=True,
+    )
+
+    # Tables in document order whose listing is decided once their end tag is reached, nested
+    # tables end before their parent but are counted after it
+    pending = []
+    listed_count = 0
+    for event, table in context:
+        if event == "start":
+            pending.append([table, None])
+            continue
+
+        for entry in pending:
+            if entry[0] is table:
+                entry[1] = _is_listed(table)
+                break
+
+        while pending and pending[0][1] is not None:
+            element, listed = pending.pop(0)
+            if listed:
+                if listed_count == index:
+                    return element
+                listed_count += 1
+            if not pending:
+                # Nothing refers to the parsed tables anymore
+                element.clear()
+
+    if listed_count == 0:
+        raise ValueError("No tables found")
+    raise IndexError(f"Table {index} not found, the page has {listed_count} tables")
+
+def _expand_colspan_rowspan(rows) -> list:
+    """
+    Expands the <tr>s into rows of cells, where a cell with `rowspan` or `colspan` is repeated in
+    every position it covers. Cells are kept as elements, so that only the text of the columns
+    actually read is ever extracted.
+    """
+    all_cells = []
+    remainder = []  # list of (index, cell, nrows)
+
+    for tr in rows:
+        cells = []
+        next_remainder = []
+
+        index = 0
+        for td in _cells(tr):
+            # Append cells from previous rows with rowspan>1 that come before this cell
+            while remainder and remainder[0][0] <= index:
+                prev_i, prev_cell, prev_rowspan = remainder.pop(0)
+                cells.append(prev_cell)
+                if prev_rowspan > 1:
+                    next_remainder.append((prev_i, prev_cell, prev_rowspan - 1))
+                index += 1
+
+            # Append this cell, colspan times
+            rowspan = int(td.get("rowspan") or 1)
+            colspan = int(td.get("colspan") or 1)
+
+            for _ in range(colspan):
+                cells.append(td)
+                if rowspan > 1:
+                    next_remainder.append((index, td, rowspan - 1))
+                index += 1
+
+        # Append cells from previous rows at the final position
+        for prev_i, prev_cell, prev_rowspan in remainder:
+            cells.append(prev_cell)
+            if prev_rowspan > 1:
+                next_remainder.append((prev_i, prev_cell, prev_rowspan - 1))
+
+        all_cells.append(cells)
+        remainder = next_remainder
+
+    # Append rows that only appear because the previous row had non-1 rowspan
+    while remainder:
+        next_remainder = []
+        cells = []
+        for prev_i, prev_cell, prev_rowspan in remainder:
+            cells.append(prev_cell)
+            if prev_rowspan > 1:
+                next_remainder.append((prev_i, prev_cell, prev_rowspan - 1))
+        all_cells.append(cells)
+        remainder = next_remainder
+
+    return all_cells
+
+def _convert_column(texts: List[str]) -> list:
+    """
+    Infers the column type like the pandas python parser followed by `fillna("")`: an all-numeric
+    column becomes int (float if it has NA or decimal values), anything else stays text. NA cells
+    become "".
+    """
+    values = []
+    for text in texts:
+        if "," in text and _RE_THOUSANDS.search(text.strip()):
+            text = text.replace(",", "")
+        values.append(text)
+
+    numbers = []
+    has_na = has_float = False
+    for text in values:
+        if text in _NA_VALUES:
+            numbers.append(None)
+            has_na = True
+        elif _RE_INT.match(text):
+            numbers.append(int(text))
+        elif _RE_FLOAT.match(text):
+            numbers.append(float(text))
+            has_float = True
+        else:
+            # Not a numeric column
+            return ["" if text in _NA_VALUES else text for text in values]
+
+    if has_na or has_float:
+        return ["" if number is None else float(number) for number in numbers]
+    return numbers
+
+class HtmlTable:
+    """
+    Header and body of a table, as `pandas.read_html` would split them.
+
+    `columns` holds one tuple of header texts per column, with "Unnamed: {i}_level_{level}" for
+    empty header cells, just like the DataFrame MultiIndex.
+    """
+    def __init__(self, columns: List[Tuple[str, ...]], rows: list):
+        self.columns = columns
+        self.rows = rows
+
+    @classmethod
+    def from_element(cls, table) -> "HtmlTable":
+        for element in _styled_elements(table):
+            if _is_hidden(element):
+                element.getparent().remove(element)
+        for br in table.iter("br"):
+            br.tail = "\n" + (br.tail or "")
+
+        header_rows = []
+        for thead in table.iter("thead"):
+            header_rows.extend(child for child in thead if child.tag == "tr")
+            if _cells(thead):
+                header_rows.append(thead)
+        body_rows = _tbody_rows(table) + [child for child in table if child.tag == "tr"]
+        footer_rows = _tfoot_rows(table)
+
+        if not header_rows:
+            # Without <thead>, the top all-<th> rows are the header
+            while body_rows and all(td.tag == "th" for td in _cells(body_rows[0])):
+                header_rows.append(body_rows.pop(0))
+
+        head = [[_cell_text(cell) for cell in row] for row in _expand_colspan_rowspan(header_rows)]
+        body = _expand_colspan_rowspan(body_rows) + _expand_colspan_rowspan(footer_rows)
+
+        rows = head + body
+        if not head:
+            header = []
+        elif len(head) == 1:
+            header = [0]
+        else:
+            # Ignore all-empty-text header rows
+            header = [i for i, row in enumerate(head) if any(text for text in row)]
+
+        # Fill out ragged rows
+        width = max((len(row) for row in rows), default=0)
+        rows = [row + [""] * (width - len(row)) if len(row) < width else row for row in rows]
+
+        if header:
+            columns = [
+                tuple(rows[hr][i] or f"Unnamed: {i}_level_{level}" for level, hr in enumerate(header))
+                for i in range(width)
+            ]
+            rows = rows[header[-1] + 1:]
+        else:
+            columns = [(str(i),) for i in range(width)]
+
+        # Blank lines are skipped
+        if width == 1:
+            rows = [row for row in rows if _cell_text(row[0]).strip()]
+        return cls(columns, rows)
+
+    def find_column(self, *prefix: str) -> Optional[int]:
+        """Returns the first column whose header starts with `prefix`."""
+        for i, column in enumerate(self.columns):
+            if column[:len(prefix)] == prefix:
+                return i
+        return None
+
+    def column(self, index: int) -> list:
+        return _convert_column([_cell_text(row[index]) for row in self.rows])
+
+def read_table(response_text: str, index: int) -> HtmlTable:
+    return HtmlTable.from_element(find_table(response_text, index))
@@ -13,20 +13,39 @@
 # Copyright (c) 2023 by wildfootw <wildfootw@wildfoo.tw>
 #
 
+import asyncio
 import datetime
 import logging
 import os
 import time
 
+import aiohttp
 import pytz
-import requests
 from apscheduler.schedulers.background import BackgroundScheduler
-from requests.exceptions import HTTPError
 
 # Set up logging
 log_level = os.environ.get("LOG_LEVEL", "DEBUG").upper()
 logging.basicConfig(level=log_level, format="%(asctime)s %(levelname)s %(message)s")
 
+DATABASE_API_URL = "http://database-api"
+MOPS_CRAWLER_URL = "http://mops-crawler"
+
+# Concurrency of each stage of the harvesting pipeline
+CRAWL_CONCURRENCY = int(os.environ.get("HARVEST_CRAWL_CONCURRENCY", "10"))
+STORE_CONCURRENCY = int(os.environ.get("HARVEST_STORE_CONCURRENCY", "2"))
+STORE_BATCH_SIZE = int(os.environ.get("HARVEST_STORE_BATCH_SIZE", "50"))
+# Seconds a partial batch waits for more reports before it is stored
+STORE_FLUSH_INTERVAL = float(os.environ.get("HARVEST_STORE_FLUSH_INTERVAL", "2"))
+# Size of the queues between the stages, a full queue holds back the stage feeding it
+QUEUE_SIZE = int(os.environ.get("HARVEST_QUEUE_SIZE", "1000"))
+
+# Iterate over each report type and its corresponding supported version
+REPORT_TYPES = {
+    'balance_sheet': 'v1',
+    'income_statement': 'v1',
+    'cash_flow': 'v1'
+}
+
 def get_past_season(seasons_back):
     """
     Calculates the year and season going back from the current date based on the number of seasons specified.
@@ -67,171 +86,257 @@ def get_past_season(seasons_back):
 
     return str(past_year), str(past_season)
 
-def store_financial_report(report_type, post_data):
-    # Base URL for the database API
-    base_url = 'http://database-api/create_report/'
-
-    # Define the URL based on report_type
-    if report_type == "balance_sheet":
-        url = f'{base_url}balance_sheet/'
-    elif report_type == "income_statement":
-        url = f'{base_url}income_statement/'
-    elif report_type == "cash_flow":
-        url = f'{base_url}cash_flow/'
-    else:
+async def store_financial_reports_of_type(session, report_type, reports):
+    """Stores reports of one type with a single bulk request, returning one result per report."""
+    if report_type not in REPORT_TYPES:
         logging.error(f"Invalid report type: {report_type}")
-        return {"status_code": 400, "message": "Invalid report type"}
+        return [{"status_code": 400, "message": "Invalid report type"}] * len(reports)
+    url = f"{DATABASE_API_URL}/create_reports/{report_type}/"
 
     try:
-        response = requests.post(url, json=post_data)
+        async with session.post(url, json=reports) as response:
+            if response.status == 200:
+                body = await response.json()
+                logging.info(f"Stored {body['stored']} of {len(reports)} {report_type} reports in database")
+                return body["results"]
+            else:
+                logging.error(f"Failed to store data in database. Status code: {response.status}, Response: {await response.text()}")
+                return [{"status_code": response.status, "message": "Failed to store data in database"}] * len(reports)
+
+    except aiohttp.ClientError as e:
+        logging.error(f"Request error when storing data: {e}")
+        return [{"status_code": 500, "message": "Internal Server Error"}] * len(reports)
 
-        if response.status_code == 200:
-            logging.info("Data successfully stored in database")
-            return {"status_code": 200, "message": "Data stored successfully"}
-        else:
-            logging.error(f"Failed to store data in database. Status code: {response.status_code}, Response: {response.text}")
-            return {"status_code": response.status_code, "message": "Failed to store data in database"}
+async def store_financial_reports(session, batch):
+    """Stores a batch of (report_type, post_data) reports, with one bulk request per report type."""
+    by_type = {}
+    for i, (report_type, post_data) in enumerate(batch):
+        by_type.setdefault(report_type, []).append((i, post_data))
 
-    except requests.RequestException as e:
-        logging.error(f"Request error when storing data: {e}")
-        return {"status_code": 500, "message": "Internal Server Error"}
+    type_results = await asyncio.gather(*[
+        store_financial_reports_of_type(session, report_type, [post_data for _, post_data in items])
+        for report_type, items in by_type.items()
+    ])
 
+    results = [None] * len(batch)
+    for items, item_results in zip(by_type.values(), type_results):
+        for (i, _), result in zip(items, item_results):
+            results[i] = result
+    return results
 
 def retrieve_ticker_symbols():
     # [TODO] Implement logic to retrieve the list of companies from the database
     return ["2330", "2331"]
 
-def retrieve_financial_report_version_table(ticker_symbol, report_type):
-    base_url = "http://database-api"
-    url = f"{base_url}/{ticker_symbol}/{report_type}/version_table"
+async def retrieve_financial_report_version_tables(session, ticker_symbols):
+    """
+    Returns the version tables of all the given companies and report types in one request, as
+    {report_type: {ticker_symbol: {year: {season: version}}}}.
+    """
+    url = f"{DATABASE_API_URL}/version_tables"
+    payload = {"report_types": list(REPORT_TYPES), "ticker_symbols": ticker_symbols}
 
     try:
-        response = requests.get(url)
-        response.raise_for_status()
+        async with session.post(url, json=payload) as response:
+            response.raise_for_status()
 
-        # Assuming the API returns a JSON response
-        version_table = response.json()
-        return version_table
+            # Assuming the API returns a JSON response
+            return await response.json()
 
     # Handle HTTP errors (e.g., response code 4XX or 5XX)
-    except HTTPError as http_err:
-        logging.error(f"HTTP error occurred while retrieving report version table: {http_err}")
+    except aiohttp.ClientResponseError as http_err:
+        logging.error(f"HTTP error occurred while retrieving report version tables: {http_err}")
         raise
     # Handle other errors
     except Exception as err:
-        logging.error(f"Error occurred while retrieving report version table: {err}")
+        logging.error(f"Error occurred while retrieving report version tables: {err}")
         raise
 
-def retrieve_financial_report(ticker_symbol, report_type, year, season):
-    base_url = "http://mops-crawler"
-
+async def retrieve_financial_report(session, ticker_symbol, report_type, year, season):
     # Construct the full URL with path parameters
-    url = f"{base_url}/{ticker_symbol}/{report_type}/{year}/{season}"
+    url = f"{MOPS_CRAWLER_URL}/{ticker_symbol}/{report_type}/{year}/{season}"
 
     try:
-        # Make the GET request to the financial reports API
-        response = requests.get(url)
+        async with session.get(url) as response:
+            # If the response was successful, no Exception will be raised
+            response.raise_for_status()
 
-        # If the response was successful, no Exception will be raised
-        response.raise_for_status()
+            # Assuming the API returns a JSON response, parse it
+            return await response.json()
 
-        # Assuming the API returns a JSON response, parse it
-        report_data = response.json()
-        return report_data
-
-    except HTTPError as http_err:
+    except aiohttp.ClientResponseError as http_err:
         logging.error(f"HTTP error occurred: {http_err}")
-        # You can return a detailed error message here, or re-raise the exception
-        # depending on how you want to handle failures.
-        # return {"error": str(http_err)}
         raise
     except Exception as err:
         logging.error(f"An error occurred: {err}")
-        # You can return a detailed error message here, or re-raise the exception
-        # depending on how you want to handle failures.
-        # return {"error": str(err)}
         raise
 
-def update_financial_reports():
+def plan_missing_reports(report_version_table, supported_version):
     """
-    Updates financial reports for all companies.
+    Lists the (year, season, is_latest) periods of a company's report that have to be crawled,
+    newest first.
 
-    This function iterates through each company and updates their financial reports (balance sheet, income statement, cash flow) based on the supported version number specified in environment variables. It retrieves the current version of each company's report, compares it against the supported version, and if the version is outdated or missing (indicated by 'NDF'), it will attempt to fetch and store the updated report. The process checks the previous season first and then continues backwards for preceding seasons.
+    The previous season is always listed unless it already has the supported version. Preceding
+    seasons are listed back to the start of IFRSs, skipping the ones that already have the supported
+    version and stopping at the first season known to have no data ("NDF").
     """
-    logging.debug("Starting to update financial reports.")
+    periods = []
 
-    # Retrieve the list of company identifiers
-    ticker_symbols = retrieve_ticker_symbols()
-    logging.debug(f"Retrieved ticker symbols: {ticker_symbols}")
+    # Get the version for the past_year and past_season, default to None if not found
+    past_year, past_season = get_past_season(1) # Previous season
+    past_version = report_version_table.get(past_year, {}).get(past_season, None)
+    if past_version != supported_version:
+        periods.append((past_year, past_season, True))
 
-    # Update financial reports for each company
-    for ticker_symbol in ticker_symbols:
-        logging.debug(f"Updating reports for ticker symbol: {ticker_symbol}")
-
-        # Iterate over each report type and its corresponding supported version
-        REPORT_TYPES = {
-            'balance_sheet': 'v1',
-#            'income_statement': 'v1',
-#            'cash_flow': 'v1'
-        }
-
-        for report_type, supported_version in REPORT_TYPES.items():
-            logging.debug(f"Supported version for {report_type}: {supported_version}")
-
-            # Retrieve the current version information of the company's reports
-            report_version_table = retrieve_financial_report_version_table(ticker_symbol, report_type)
-            logging.debug(f"Current version table for {ticker_symbol}: {report_version_table}")
-
-            # Update the previous season's financial report
-            # Get the version for the past_year and past_season, default to None if not found
-            past_year, past_season = get_past_season(1) # Previous season
-            past_version = report_version_table.get(past_year, {}).get(past_season, None)
-            logging.debug(f"Version for {ticker_symbol} {report_type} {past_year} {past_season}: {past_version}")
-
-            if past_version != supported_version:
-                logging.debug(f"Version mismatch for {ticker_symbol} {report_type} {past_year} {past_season}")
-                retrieve_result = retrieve_financial_report(ticker_symbol, report_type, past_year, past_season)
-                if retrieve_result["version"] == supported_version:
-                    store_result = store_financial_report(report_type, retrieve_result)
-                    logging.debug(f"Stored financial report for {ticker_symbol} {report_type} {past_year} {past_season}")
-                elif retrieve_result["version"] == "NDF":
-                    logging.info("No data found for %s %s %s %s", ticker_symbol, report_type, past_year, past_season)
-
-            # Continue retrieving and updating data from the preceding seasons until the version is "NDF"
-            season_decrement = 2 # Preceding seasons
-            while True:
-                past_year, past_season = get_past_season(season_decrement)
-                season_decrement += 1
-                past_version = report_version_table.get(past_year, {}).get(past_season, None)
-                logging.debug(f"Version for {ticker_symbol} {report_type} {past_year} {past_season}: {past_version}")
-
-                # ROC GAAP not supported
-                if past_year == "101":
-                    logging.info(f"ROC GAAP not supported")
-                    break
+    season_decrement = 2 # Preceding seasons
+    while True:
+        past_year, past_season = get_past_season(season_decrement)
+        season_decrement += 1
+        past_version = report_version_table.get(past_year, {}).get(past_season, None)
 
-                # First check to minimize the crawler request if the version is already "NDF"
-                if past_version == "NDF":
-                    logging.debug(f"No further data to update for {ticker_symbol} {report_type} before {past_year} {past_season}")
-                    break
+        # ROC GAAP not supported
+        if past_year == "101":
+            break
+
+        # No data before a season already known to have no data
+        if past_version == "NDF":
+            break
 
-                if past_version == supported_version:
-                    logging.debug(f"Supported version already present for {ticker_symbol} {report_type} {past_year} {past_season}")
-                    continue
+        if past_version != supported_version:
+            periods.append((past_year, past_season, False))
 
-                retrieve_result = retrieve_financial_report(ticker_symbol, report_type, past_year, past_season)
-                if retrieve_result["version"] == supported_version:
-                    store_result = store_financial_report(report_type, retrieve_result)
-                    logging.debug(f"Stored financial report for {ticker_symbol} {report_type} {past_year} {past_season}")
+    return periods
 
-                # Second check after attempting to update, in case the crawler finds no new data
-                elif retrieve_result["version"] == "NDF":
-                    store_result = store_financial_report(report_type, retrieve_result)
-                    logging.info("No data found for %s %s %s %s", ticker_symbol, report_type, past_year, past_season)
+class HarvestRun:
+    """
+    One run of the harvesting pipeline:
+
+        version tables -> work queue -> crawl workers -> store queue -> batched store workers
+
+    The planner fetches the version tables of every (ticker, report type) in one request and queues
+    the missing periods, crawl workers fetch them from mops-crawler, and store workers write them to the database in
+    batches. Every stage has its own concurrency and the bounded queues between them apply back
+    pressure to the previous stage.
+    """
+    def __init__(self, session):
+        self.session = session
+        self.work_queue = asyncio.Queue(maxsize=QUEUE_SIZE)
+        self.store_queue = asyncio.Queue(maxsize=QUEUE_SIZE)
+        # Oldest (year, season) worth crawling per (ticker, report type), set once a season has no data
+        self.no_data_before = {}
+        self.counters = {"planned": 0, "crawled": 0, "skipped": 0, "failed": 0, "stored": 0, "store_failed": 0}
+
+    async def plan(self, ticker_symbols):
+        try:
+            version_tables = await retrieve_financial_report_version_tables(self.session, ticker_symbols)
+        except Exception:
+            logging.error("Skipping this run, version tables unavailable")
+            return
+
+        for ticker_symbol in ticker_symbols:
+            for report_type, supported_version in REPORT_TYPES.items():
+                report_version_table = version_tables.get(report_type, {}).get(ticker_symbol, {})
+                logging.debug(f"Current version table for {ticker_symbol} {report_type}: {report_version_table}")
+
+                for year, season, is_latest in plan_missing_reports(report_version_table, supported_version):
+                    self.counters["planned"] += 1
+                    await self.work_queue.put((ticker_symbol, report_type, year, season, is_latest))
+
+    async def crawl(self):
+        while True:
+            job = await self.work_queue.get()
+            if job is None:
+                return
+            ticker_symbol, report_type, year, season, is_latest = job
+            supported_version = REPORT_TYPES[report_type]
+
+            no_data_before = self.no_data_before.get((ticker_symbol, report_type))
+            if no_data_before and (int(year), int(season)) < no_data_before:
+                self.counters["skipped"] += 1
+                continue
+
+            try:
+                retrieve_result = await retrieve_financial_report(self.session, ticker_symbol, report_type, year, season)
+            except Exception:
+                self.counters["failed"] += 1
+                continue
+            self.counters["crawled"] += 1
+
+            version = retrieve_result.get("version")
+            if version == supported_version:
+                await self.store_queue.put((report_type, retrieve_result))
+            elif version == "NDF":
+                logging.info("No data found for %s %s %s %s", ticker_symbol, report_type, year, season)
+                # The latest season may still be published later, older ones won't
+                if not is_latest:
+                    await self.store_queue.put((report_type, retrieve_result))
+                    key = (ticker_symbol, report_type)
+                    self.no_data_before[key] = max(self.no_data_before.get(key, (0, 0)), (int(year), int(season)))
+            else:
+                logging.warning(f"Unexpected version {version} for {ticker_symbol} {report_type} {year} {season}")
+
+    async def store(self):
+        while True:
+            batch = []
+            deadline = time.monotonic() + STORE_FLUSH_INTERVAL
+            finished = False
+            while len(batch) < STORE_BATCH_SIZE:
+                try:
+                    item = await asyncio.wait_for(self.store_queue.get(), max(deadline - time.monotonic(), 0))
+                except asyncio.TimeoutError:
                     break
+                if item is None:
+                    finished = True
+                    break
+                batch.append(item)
+
+            if batch:
+                results = await store_financial_reports(self.session, batch)
+                stored = sum(result["status_code"] == 200 for result in results)
+                self.counters["stored"] += stored
+                self.counters["store_failed"] += len(results) - stored
+                logging.debug(f"Stored batch of {len(batch)} reports, {stored} succeeded")
+            if finished:
+                return
+
+    async def run(self, ticker_symbols):
+        crawlers = [asyncio.create_task(self.crawl()) for _ in range(CRAWL_CONCURRENCY)]
+        storers = [asyncio.create_task(self.store()) for _ in range(STORE_CONCURRENCY)]
+
+        # Each stage is closed once the previous one has drained
+        await self.plan(ticker_symbols)
+        for _ in crawlers:
+            await self.work_queue.put(None)
+        await asyncio.gather(*crawlers)
+        for _ in storers:
+            await self.store_queue.put(None)
+        await asyncio.gather(*storers)
+
+        return self.counters
+
+async def harvest_financial_reports():
+    # Retrieve the list of company identifiers
+    ticker_symbols = retrieve_ticker_symbols()
+    logging.debug(f"Retrieved ticker symbols: {ticker_symbols}")
 
-    logging.debug("Finished updating financial reports.")
+    connector = aiohttp.TCPConnector(limit=1 + CRAWL_CONCURRENCY + STORE_CONCURRENCY * len(REPORT_TYPES))
+    async with aiohttp.ClientSession(connector=connector) as session:
+        return await HarvestRun(session).run(ticker_symbols)
+
+def update_financial_reports():
+    """
+    Updates financial reports for all companies.
 
+    For every company and report type (balance sheet, income statement, cash flow), the current
+    version of each season's report is compared against the supported version specified in
+    REPORT_TYPES. Outdated or missing reports are fetched and stored, starting with the previous
+    season and continuing backwards until a season without data ("NDF"). The work runs as a
+    concurrent pipeline, see HarvestRun.
+    """
+    logging.debug("Starting to update financial reports.")
+    start = time.monotonic()
+    counters = asyncio.run(harvest_financial_reports())
+    logging.info(f"Finished updating financial reports in {time.monotonic() - start:.1f} seconds: {counters}")
 
 def schedule_updates():
     scheduler = BackgroundScheduler()
@@ -0,0 +1,129 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+# vim:fenc=utf-8
+#
+# TradeWiSE Project
+#
+# This file is part of the TradeWiSE project, an automated trading and financial analysis platform.
+# It is licensed under the Mozilla Public License 2.0 (MPL 2.0), which allows for wide use and modification
+# while ensuring that enhancements and modifications remain available to the community.
+#
+# You can find the MPL 2.0 license in the root directory of the project or at https://www.mozilla.org/MPL/2.0/.
+#
+# Copyright (c) 2023 by wildfootw <wildfootw@wildfoo.tw>
+#
+"""
+Stand-in for the Telegram Bot API, for testing the bot without Telegram.
+
+Point the bot at it with TELEGRAM_API_URL and run it with `uvicorn fake_bot_api:app`. It answers
+the Bot API methods the bot uses and records the messages sent, and it can deliver updates to the
+registered webhook as Telegram would:
+
+    POST /updates   {"chat_id": 1, "text": "/start"}   Delivers a message update to the webhook
+    GET  /messages?chat_id=1                           Messages sent by the bot
+    DELETE /messages                                   Forgets the recorded messages
+    GET  /webhook                                      The registered webhook
+"""
+from __future__ import annotations
+
+import itertools
+import json
+import time
+from typing import Optional
+from urllib.parse import parse_qsl
+
+import httpx
+from fastapi import FastAPI, HTTPException, Request
+from pydantic import BaseModel
+
+app = FastAPI()
+
+BOT_USER = {"id": 1, "is_bot": True, "first_name": "TradeWiSE", "username": "tradewise_bot"}
+
+webhook: dict = {"url": "", "secret_token": None}
+messages: list[dict] = []
+update_ids = itertools.count(1)
+message_ids = itertools.count(1)
+
+async def read_parameters(request: Request) -> dict:
+    """The bot sends form fields with JSON encoded values, or a JSON body."""
+    body = await request.body()
+    if request.headers.get("content-type", "").startswith("application/json"):
+        return json.loads(body or b"{}")
+    parameters = {}
+    for key, value in parse_qsl(body.decode()):
+        try:
+            parameters[key] = json.loads(value)
+        except ValueError:
+            parameters[key] = value
+    return parameters
+
+@app.post("/bot{token}/{method}")
+async def call_method(token: str, method: str, request: Request):
+    parameters = await read_parameters(request)
+    if method == "getMe":
+        result = BOT_USER
+    elif method == "setWebhook":
+        webhook["url"] = parameters.get("url", "")
+        webhook["secret_token"] = parameters.get("secret_token")
+        result = True
+    elif method == "deleteWebhook":
+        webhook["url"] = ""
+        result = True
+    elif method == "sendMessage":
+        result = {
+            "message_id": next(message_ids),
+            "date": int(time.time()),
+            "chat": {"id": int(parameters["chat_id"]), "type": "private"},
+            "from": BOT_USER,
+            "text": parameters.get("text", ""),
+        }
+        messages.append({**result, "parse_mode": parameters.get("parse_mode"), "received_at": time.time()})
+    else:
+        result = True
+    return {"ok": True, "result": result}
+
+class IncomingMessage(BaseModel):
+    chat_id: int
+    text: str
+    user_id: Optional[int] = None
+
+@app.post("/updates")
+async def deliver_update(message: IncomingMessage):
+    if not webhook["url"]:
+        raise HTTPException(status_code=409, detail="No webhook registered")
+    user = {"id": message.user_id or message.chat_id, "is_bot": False, "first_name": "Test"}
+    text = message.text
+    entities = []
+    if text.startswith("/"):
+        entities.append({"type": "bot_command", "offset": 0, "length": len(text.split()[0])})
+    update = {
+        "update_id": next(update_ids),
+        "message": {
+            "message_id": next(message_ids),
+            "date": int(time.time()),
+            "chat": {"id": message.chat_id, "type": "private"},
+            "from": user,
+            "text": text,
+            "entities": entities,
+        },
+    }
+    headers = {}
+    if webhook["secret_token"]:
+        headers["X-Telegram-Bot-Api-Secret-Token"] = webhook["secret_token"]
+    async with httpx.AsyncClient() as client:
+        response = await client.post(webhook["url"], json=update, headers=headers)
+    return {"update_id": update["update_id"], "status_code": response.status_code, "sent_at": time.time()}
+
+@app.get("/messages")
+async def read_messages(chat_id: Optional[int] = None):
+    return [message for message in messages if chat_id is None or message["chat"]["id"] == chat_id]
+
+@app.delete("/messages")
+async def clear_messages():
+    messages.clear()
+    return {}
+
+@app.get("/webhook")
+async def read_webhook():
+    return webhook
@@ -14,14 +14,19 @@
 #
 from __future__ import annotations
 
-import json
+import html
 import logging
 import os
 from typing import TYPE_CHECKING, cast
+from urllib.parse import urlparse
 
-import requests
+import httpx
+import uvicorn
+from service_client import ServiceClient
 from telegram import Bot, BotCommand, Update
-from telegram.ext import ApplicationBuilder, CommandHandler, ContextTypes
+from telegram.constants import ParseMode
+from telegram.ext import ApplicationBuilder, CommandHandler, ContextTypes, PicklePersistence
+from webhook import create_webhook_app
 
 if TYPE_CHECKING:
     from telegram.ext import Application
@@ -36,9 +41,39 @@ def get_env_or_raise(name: str) -> str:
 telegram_bot_token = get_env_or_raise('TELEGRAM_BOT_TOKEN')
 telegram_bot_auth_user_id = get_env_or_raise('TELEGRAM_BOT_AUTH_USER_ID')
 
+FUGLE_MARKET_DATA_URL = os.getenv('FUGLE_MARKET_DATA_URL', 'http://fugle-market-data:80')
+
+# Calls to the other services: seconds before giving up on a request, retries of transient failures, and pooled connections
+SERVICE_TIMEOUT = float(os.getenv('SERVICE_TIMEOUT', '5'))
+SERVICE_RETRIES = int(os.getenv('SERVICE_RETRIES', '2'))
+SERVICE_MAX_CONNECTIONS = int(os.getenv('SERVICE_MAX_CONNECTIONS', '20'))
+
+# Seconds the market data service waits for quotes, and most symbols per /stock or watchlist
+QUOTES_TIMEOUT = float(os.getenv('QUOTES_TIMEOUT', '4'))
+MAX_SYMBOLS = int(os.getenv('MAX_SYMBOLS', '50'))
+
+# User data such as watchlists survives restarts in this file
+BOT_PERSISTENCE_FILE = os.getenv('BOT_PERSISTENCE_FILE', '/var/lib/telegram-bot/bot.pickle')
+
+# Updates handled at once, a slow command no longer holds up the other chats
+BOT_CONCURRENT_UPDATES = int(os.getenv('BOT_CONCURRENT_UPDATES', '16'))
+
+# Telegram Bot API server, replaced by fake_bot_api in tests
+TELEGRAM_API_URL = os.getenv('TELEGRAM_API_URL', 'https://api.telegram.org')
+
+# "polling" asks Telegram for updates, "webhook" has Telegram post them to BOT_WEBHOOK_URL
+BOT_MODE = os.getenv('BOT_MODE', 'polling')
+BOT_WEBHOOK_URL = os.getenv('BOT_WEBHOOK_URL')
+BOT_WEBHOOK_SECRET = os.getenv('BOT_WEBHOOK_SECRET')
+BOT_WEBHOOK_PORT = int(os.getenv('BOT_WEBHOOK_PORT', '80'))
+# Webhook updates waiting for a worker
+BOT_UPDATE_QUEUE_SIZE = int(os.getenv('BOT_UPDATE_QUEUE_SIZE', '256'))
+
 # Configure logging
 logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
 
+services = ServiceClient(timeout=SERVICE_TIMEOUT, retries=SERVICE_RETRIES, max_connections=SERVICE_MAX_CONNECTIONS)
+
 
 class _BaseCommand:
     command: str
@@ -61,31 +96,104 @@ class StartCommand(_BaseCommand):
             return
         await update.message.reply_text("Welcome to TradeWiSE! Your trading assistant.")
 
+async def get_stock_prices(symbols: list[str]) -> tuple[dict, dict]:
+    """Quotes of `symbols` from one batched call, as ({symbol: quote}, {symbol: error message})."""
+    try:
+        response = await services.get(
+            f'{FUGLE_MARKET_DATA_URL}/prices',
+            params={'symbols': ','.join(symbols), 'timeout': QUOTES_TIMEOUT},
+            # The service answers within QUOTES_TIMEOUT, leave it time to do so
+            timeout=QUOTES_TIMEOUT + SERVICE_TIMEOUT,
+        )
+    except httpx.HTTPError as e:
+        logging.error(f"Failed to get stock prices of {symbols}: {e!r}")
+        return {}, {symbol: f'Unable to fetch data: {e!r}' for symbol in symbols}
+    if response.status_code != 200:
+        return {}, {symbol: f'Unable to fetch data: {response.text}' for symbol in symbols}
+    data = response.json()
+    return data['prices'], data['errors']
+
+def format_quote_table(symbols: list[str], prices: dict, errors: dict) -> str:
+    """One row per symbol in a monospaced block. The name comes last, its width varies."""
+    rows = [f"{'Symbol':<7}{'Last':>9}{'Chg':>8}{'Chg%':>8}  Name"]
+    for symbol in symbols:
+        quote = prices.get(symbol)
+        if quote is None:
+            rows.append(f"{symbol:<7}  {errors.get(symbol, 'No data')}")
+            continue
+        last_price = quote.get('lastPrice')
+        change = quote.get('change')
+        change_percent = quote.get('changePercent')
+        rows.append(
+            f"{symbol:<7}"
+            f"{last_price if last_price is not None else '-':>9}"
+            f"{f'{change:+.2f}' if change is not None else '-':>8}"
+            f"{f'{change_percent:+.2f}%' if change_percent is not None else '-':>8}"
+            f"  {quote.get('name', '')}"
+        )
+    return f"<pre>{html.escape(chr(10).join(rows))}</pre>"
+
+async def reply_quote_table(update: Update, symbols: list[str]) -> None:
+    prices, errors = await get_stock_prices(symbols)
+    await update.message.reply_text(format_quote_table(symbols, prices, errors), parse_mode=ParseMode.HTML)
+
+def parse_symbols(args: list[str]) -> list[str]:
+    """Symbols from command arguments separated by spaces or commas, without duplicates."""
+    return list(dict.fromkeys(symbol.upper() for arg in args for symbol in arg.split(',') if symbol))
+
 class StockCommand(_BaseCommand):
     command = "stock"
-    description = "Get stock price"
+    description = "Get stock prices"
 
     @staticmethod
     async def handle(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         if not await is_user_authorized(update, context):
             return
-        args = context.args
-        if not args:
-            await update.message.reply_text("Please provide a stock symbol. Usage: /stock <symbol>")
+        symbols = parse_symbols(context.args or [])
+        if not symbols:
+            await update.message.reply_text("Please provide a stock symbol. Usage: /stock <symbol> [<symbol> ...]")
             return
-        symbol = args[0]
-        data = StockCommand.get_stock_price(symbol)
-        await update.message.reply_text(data)
+        if len(symbols) > MAX_SYMBOLS:
+            await update.message.reply_text(f"At most {MAX_SYMBOLS} symbols at once.")
+            return
+        await reply_quote_table(update, symbols)
+
+class WatchlistCommand(_BaseCommand):
+    command = "watchlist"
+    description = "Show or edit the watchlist"
+    usage = "Usage: /watchlist, /watchlist add <symbol> [<symbol> ...], /watchlist remove <symbol> [<symbol> ...], /watchlist clear"
 
     @staticmethod
-    def get_stock_price(symbol: str) -> str:
-        response = requests.get(f'http://fugle-market-data:80/price/{symbol}')
-        if response.status_code == 200:
-            return response.text
+    async def handle(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+        if not await is_user_authorized(update, context):
+            return
+        # Saved by the persistence of the application
+        watchlist: list[str] = context.user_data.setdefault('watchlist', [])
+        action, *args = context.args or ['show']
+        symbols = parse_symbols(args)
+
+        if action == 'show':
+            if not watchlist:
+                await update.message.reply_text(f"The watchlist is empty. {WatchlistCommand.usage}")
+                return
+            await reply_quote_table(update, watchlist)
+        elif action == 'add' and symbols:
+            added = [symbol for symbol in symbols if symbol not in watchlist]
+            if len(watchlist) + len(added) > MAX_SYMBOLS:
+                await update.message.reply_text(f"The watchlist holds at most {MAX_SYMBOLS} symbols.")
+                return
+            watchlist.extend(added)
+            await update.message.reply_text(f"Watchlist: {' '.join(watchlist)}")
+        elif action == 'remove' and symbols:
+            watchlist[:] = [symbol for symbol in watchlist if symbol not in symbols]
+            await update.message.reply_text(f"Watchlist: {' '.join(watchlist) or '(empty)'}")
+        elif action == 'clear':
+            watchlist.clear()
+            await update.message.reply_text("Watchlist cleared.")
         else:
-            return json.dumps({'error': f'Unable to fetch data: {response.text}'})
+            await update.message.reply_text(WatchlistCommand.usage)
 
-_commands: list[_BaseCommand] = [StartCommand(), StockCommand()]
+_commands: list[_BaseCommand] = [StartCommand(), StockCommand(), WatchlistCommand()]
 
 
 async def is_user_authorized(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -96,20 +204,52 @@ async def is_user_authorized(update: Update, context: ContextTypes.DEFAULT_TYPE)
     return True
 
 async def post_init(application: Application) -> None:
+    await services.start()
     # Set bot commands so that they are shown in the bot menu
     await cast(Bot, application.bot).set_my_commands(
         [cmd.to_bot_command() for cmd in _commands]
     )
 
-def main():
-    application = ApplicationBuilder().token(telegram_bot_token).post_init(post_init).build()
+async def post_shutdown(application: Application) -> None:
+    await services.close()
+
+def build_application() -> Application:
+    os.makedirs(os.path.dirname(BOT_PERSISTENCE_FILE), exist_ok=True)
+    application = (
+        ApplicationBuilder()
+        .token(telegram_bot_token)
+        .base_url(f'{TELEGRAM_API_URL}/bot')
+        .base_file_url(f'{TELEGRAM_API_URL}/file/bot')
+        .concurrent_updates(BOT_CONCURRENT_UPDATES)
+        .persistence(PicklePersistence(filepath=BOT_PERSISTENCE_FILE))
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
+        .build()
+    )
 
     # Register handlers
     for cmd in _commands:
         application.add_handler(CommandHandler(cmd.command, cmd.handle))
+    return application
+
+def main():
+    application = build_application()
 
     # Start the bot
-    application.run_polling()
+    if BOT_MODE == 'webhook':
+        if not BOT_WEBHOOK_URL:
+            raise ValueError('Environment variable "BOT_WEBHOOK_URL" not set')
+        app = create_webhook_app(
+            application,
+            BOT_WEBHOOK_URL,
+            path=urlparse(BOT_WEBHOOK_URL).path or '/',
+            secret_token=BOT_WEBHOOK_SECRET,
+            workers=BOT_CONCURRENT_UPDATES,
+            queue_size=BOT_UPDATE_QUEUE_SIZE,
+        )
+        uvicorn.run(app, host='0.0.0.0', port=BOT_WEBHOOK_PORT)
+    else:
+        application.run_polling()
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,72 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+# vim:fenc=utf-8
+#
+# TradeWiSE Project
+#
+# This file is part of the TradeWiSE project, an automated trading and financial analysis platform.
+# It is licensed under the Mozilla Public License 2.0 (MPL 2.0), which allows for wide use and modification
+# while ensuring that enhancements and modifications remain available to the community.
+#
+# You can find the MPL 2.0 license in the root directory of the project or at https://www.mozilla.org/MPL/2.0/.
+#
+# Copyright (c) 2023 by wildfootw <wildfootw@wildfoo.tw>
+#
+from __future__ import annotations
+
+import asyncio
+import logging
+from typing import Any, Optional
+
+import httpx
+
+# Responses worth another attempt, the request itself was fine
+RETRY_STATUS_CODES = {429, 502, 503, 504}
+
+class ServiceClient:
+    """
+    Shared async HTTP client for the calls of the bot to the other TradeWiSE services.
+
+    One connection pool is kept for the lifetime of the bot, every request has a timeout, and
+    requests failing with a connection error, a timeout or a transient status are retried with
+    exponential backoff. Call `start` before the first request and `close` on shutdown.
+    """
+    def __init__(self, timeout: float = 5, retries: int = 2, backoff: float = 0.2, max_connections: int = 20):
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.max_connections = max_connections
+        self._client: Optional[httpx.AsyncClient] = None
+
+    async def start(self):
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                timeout=self.timeout,
+                limits=httpx.Limits(max_connections=self.max_connections, max_keepalive_connections=self.max_connections),
+            )
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def request(self, method: str, url: str, **kwargs: Any) -> httpx.Response:
+        """Sends a request, retrying transient failures. Raises the last error once the retries are used up."""
+        if self._client is None:
+            raise RuntimeError("ServiceClient is not started")
+        attempt = 0
+        while True:
+            try:
+                response = await self._client.request(method, url, **kwargs)
+                if response.status_code not in RETRY_STATUS_CODES or attempt >= self.retries:
+                    return response
+                logging.warning(f"{method} {url} returned {response.status_code}, retrying")
+            except httpx.TransportError as e:
+                if attempt >= self.retries:
+                    raise
+                logging.warning(f"{method} {url} failed, retrying: {e!r}")
+            await asyncio.sleep(self.backoff * 2 ** attempt)
+            attempt += 1
+
+    async def get(self, url: str, **kwargs: Any) -> httpx.Response:
+        return await self.request("GET", url, **kwargs)
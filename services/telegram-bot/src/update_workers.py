@@ -0,0 +1,120 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+# vim:fenc=utf-8
+#
+# TradeWiSE Project
+#
+# This file is part of the TradeWiSE project, an automated trading and financial analysis platform.
+# It is licensed under the Mozilla Public License 2.0 (MPL 2.0), which allows for wide use and modification
+# while ensuring that enhancements and modifications remain available to the community.
+#
+# You can find the MPL 2.0 license in the root directory of the project or at https://www.mozilla.org/MPL/2.0/.
+#
+# Copyright (c) 2023 by wildfootw <wildfootw@wildfoo.tw>
+#
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+from typing import Awaitable, Callable, Optional
+
+from telegram import Update
+
+
+class UpdateWorkerPool:
+    """
+    Bounded queue of incoming updates, processed by a fixed number of concurrent workers.
+
+    Updates of different chats run concurrently, updates of the same chat run one at a time in the
+    order they were queued: a worker takes the lock of the chat right after taking the update off
+    the queue, and asyncio locks are granted first come, first served.
+    """
+    def __init__(self, process: Callable[[Update], Awaitable[None]], workers: int = 16, queue_size: int = 256):
+        self.process = process
+        self.workers = workers
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self.processed = 0
+        self.failed = 0
+        self.rejected = 0
+        # Seconds from queueing an update to starting to process it, and to being done with it
+        self.wait_time = {"last": None, "max": 0.0, "total": 0.0}
+        self.process_time = {"last": None, "max": 0.0, "total": 0.0}
+        # Lock of each chat with updates in progress, and how many of its updates hold or wait for it
+        self._chat_locks: dict[Optional[int], list] = {}
+        self._tasks: list[asyncio.Task] = []
+
+    def start(self):
+        self._tasks = [asyncio.create_task(self._work()) for _ in range(self.workers)]
+
+    async def stop(self):
+        """Processes the updates still queued, then stops the workers."""
+        await self.queue.join()
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def put(self, update: Update, timeout: float) -> bool:
+        """Queues `update`, waiting up to `timeout` seconds for room. Returns False if the queue stayed full."""
+        try:
+            await asyncio.wait_for(self.queue.put((update, time.monotonic())), timeout)
+            return True
+        except asyncio.TimeoutError:
+            self.rejected += 1
+            return False
+
+    async def _work(self):
+        while True:
+            update, queued_at = await self.queue.get()
+            try:
+                chat_id = update.effective_chat.id if update.effective_chat else None
+                entry = self._chat_locks.setdefault(chat_id, [asyncio.Lock(), 0])
+                entry[1] += 1
+                try:
+                    await self._process(update, queued_at, entry[0])
+                finally:
+                    entry[1] -= 1
+                    if entry[1] == 0:
+                        del self._chat_locks[chat_id]
+            finally:
+                self.queue.task_done()
+
+    async def _process(self, update: Update, queued_at: float, lock: asyncio.Lock):
+        async with lock:
+            started_at = time.monotonic()
+            self._record(self.wait_time, started_at - queued_at)
+            try:
+                await self.process(update)
+                self.processed += 1
+            except Exception as e:
+                self.failed += 1
+                logging.exception(f"Failed to process update {update.update_id}: {e!r}")
+            self._record(self.process_time, time.monotonic() - started_at)
+
+    @staticmethod
+    def _record(timing: dict, seconds: float):
+        timing["last"] = seconds
+        timing["max"] = max(timing["max"], seconds)
+        timing["total"] += seconds
+
+    def stats(self) -> dict:
+        done = self.processed + self.failed
+        return {
+            "workers": self.workers,
+            "queued": self.queue.qsize(),
+            "queue_size": self.queue.maxsize,
+            "processed": self.processed,
+            "failed": self.failed,
+            "rejected": self.rejected,
+            "wait_ms": {
+                "last": self.wait_time["last"] * 1000 if self.wait_time["last"] is not None else None,
+                "max": self.wait_time["max"] * 1000,
+                "mean": self.wait_time["total"] / done * 1000 if done else None,
+            },
+            "process_ms": {
+                "last": self.process_time["last"] * 1000 if self.process_time["last"] is not None else None,
+                "max": self.process_time["max"] * 1000,
+                "mean": self.process_time["total"] / done * 1000 if done else None,
+            },
+        }
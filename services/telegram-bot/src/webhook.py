@@ -0,0 +1,91 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+# vim:fenc=utf-8
+#
+# TradeWiSE Project
+#
+# This file is part of the TradeWiSE project, an automated trading and financial analysis platform.
+# It is licensed under the Mozilla Public License 2.0 (MPL 2.0), which allows for wide use and modification
+# while ensuring that enhancements and modifications remain available to the community.
+#
+# You can find the MPL 2.0 license in the root directory of the project or at https://www.mozilla.org/MPL/2.0/.
+#
+# Copyright (c) 2023 by wildfootw <wildfootw@wildfoo.tw>
+#
+from __future__ import annotations
+
+import hmac
+import logging
+from contextlib import asynccontextmanager
+from typing import TYPE_CHECKING, Optional
+
+from fastapi import FastAPI, HTTPException, Request
+from telegram import Update
+from update_workers import UpdateWorkerPool
+
+if TYPE_CHECKING:
+    from telegram.ext import Application
+
+
+def create_webhook_app(
+    application: Application,
+    webhook_url: str,
+    path: str = "/telegram",
+    secret_token: Optional[str] = None,
+    workers: int = 16,
+    queue_size: int = 256,
+    queue_timeout: float = 1,
+) -> FastAPI:
+    """
+    ASGI app receiving the updates of `application` from Telegram at `path`.
+
+    The app runs the lifecycle of `application` the way `run_polling` does, and registers
+    `webhook_url` with Telegram on startup. Updates are answered right after they are queued on a
+    `UpdateWorkerPool`. When the queue stays full for `queue_timeout` seconds the update is refused
+    with 503, and Telegram delivers it again later.
+    """
+    pool = UpdateWorkerPool(application.process_update, workers=workers, queue_size=queue_size)
+
+    @asynccontextmanager
+    async def lifespan(app: FastAPI):
+        await application.initialize()
+        if application.post_init:
+            await application.post_init(application)
+        await application.bot.set_webhook(webhook_url, secret_token=secret_token, allowed_updates=Update.ALL_TYPES)
+        await application.start()
+        pool.start()
+        logging.info(f"Receiving updates at {webhook_url}")
+        yield
+        await pool.stop()
+        await application.stop()
+        if application.post_stop:
+            await application.post_stop(application)
+        await application.shutdown()
+        if application.post_shutdown:
+            await application.post_shutdown(application)
+
+    app = FastAPI(lifespan=lifespan)
+
+    @app.post(path)
+    async def receive_update(request: Request):
+        if secret_token is not None:
+            received = request.headers.get("X-Telegram-Bot-Api-Secret-Token", "")
+            if not hmac.compare_digest(received, secret_token):
+                raise HTTPException(status_code=403, detail="Invalid secret token")
+        update = Update.de_json(await request.json(), application.bot)
+        if update is None:
+            raise HTTPException(status_code=400, detail="Invalid update")
+        if not await pool.put(update, queue_timeout):
+            logging.warning(f"Update queue full, refused update {update.update_id}")
+            raise HTTPException(status_code=503, detail="Update queue full")
+        return {}
+
+    @app.get("/health")
+    async def health():
+        return {"status": "ok"}
+
+    @app.get("/stats")
+    async def read_stats():
+        return pool.stats()
+
+    return app
@@ -13,6 +13,8 @@
 # Copyright (c) 2023 by wildfootw <wildfootw@wildfoo.tw>
 #
 
+import json
+
 import requests
 
 
@@ -52,3 +54,143 @@ def test_balance_sheet():
 
     response = requests.delete(url)
     assert response.status_code == 404
+
+
+def test_version_tables():
+    base_url = 'http://database-api/'
+
+    post_data = {"ticker_symbol": "TEST", "reporting_year": 111, "reporting_season": 4, "version": "v1"}
+    response = requests.post(f'{base_url}create_report/balance_sheet', json=post_data)
+    assert response.status_code == 200
+
+    url = f'{base_url}version_tables'
+    response = requests.post(url, json={"report_types": ["balance_sheet", "cash_flow"], "ticker_symbols": ["TEST"]})
+    assert response.status_code == 200
+    assert response.json() == {"balance_sheet": {"TEST": {"111": {"4": "v1"}}}, "cash_flow": {}}
+
+    # The bulk tables match the per-company endpoint
+    response = requests.get(f'{base_url}TEST/balance_sheet/version_table')
+    assert response.json() == {"111": {"4": "v1"}}
+
+    response = requests.delete(f'{base_url}TEST/balance_sheet/111/4')
+    assert response.status_code == 200
+
+
+def test_create_reports():
+    base_url = 'http://database-api/'
+    url = f'{base_url}create_reports/balance_sheet/'
+
+    reports = [
+        {"ticker_symbol": "TEST", "reporting_year": 111, "reporting_season": season, "version": "v1", "現金及約當現金": season}
+        for season in (1, 2)
+    ]
+    reports.append({"ticker_symbol": "TEST", "reporting_year": 111})
+    response = requests.post(url, json=reports)
+    assert response.status_code == 200
+    assert [result["status_code"] for result in response.json()["results"]] == [200, 200, 422]
+
+    # NDJSON input, existing reports are replaced
+    reports[0]["現金及約當現金"] = 10
+    body = "\n".join(json.dumps(report) for report in reports[:2])
+    response = requests.post(url, data=body.encode("utf-8"), headers={"Content-Type": "application/x-ndjson"})
+    assert response.status_code == 200
+    assert [result["message"] for result in response.json()["results"]] == ["updated", "updated"]
+
+    response = requests.get(f'{base_url}TEST/balance_sheet/111/1')
+    assert response.json()["現金及約當現金"] == 10
+
+    for season in (1, 2):
+        response = requests.delete(f'{base_url}TEST/balance_sheet/111/{season}')
+        assert response.status_code == 200
+
+
+def test_new_version_replaces_report():
+    base_url = 'http://database-api/'
+    key = {"ticker_symbol": "TEST", "reporting_year": 111, "reporting_season": 3}
+
+    response = requests.post(f'{base_url}create_report/balance_sheet', json={**key, "version": "v1", "現金及約當現金": 1.0})
+    assert response.status_code == 200
+
+    # One report per period, whatever its version
+    response = requests.post(f'{base_url}create_report/balance_sheet', json={**key, "version": "v2"})
+    assert response.status_code == 409
+
+    response = requests.post(f'{base_url}create_reports/balance_sheet/', json=[{**key, "version": "v2", "現金及約當現金": 2.0}])
+    assert response.json()["results"] == [{"status_code": 200, "message": "updated"}]
+
+    response = requests.get(f'{base_url}TEST/balance_sheet/111/3')
+    assert response.json()["version"] == "v2" and response.json()["現金及約當現金"] == 2
+
+    response = requests.get(f'{base_url}TEST/balance_sheet/version_table')
+    assert response.json() == {"111": {"3": "v2"}}
+
+    query = {"accounts": ["現金及約當現金"], "ticker_symbols": ["TEST"], "start": {"year": 111, "season": 3}, "end": {"year": 111, "season": 3}}
+    response = requests.post(f'{base_url}query/balance_sheet', json=query)
+    assert response.json()["rows"] == 1
+
+    response = requests.delete(f'{base_url}TEST/balance_sheet/111/3')
+    assert response.status_code == 200
+    response = requests.get(f'{base_url}TEST/balance_sheet/111/3')
+    assert response.status_code == 404
+
+def test_account_across_companies():
+    base_url = 'http://database-api/'
+
+    reports = [
+        {"ticker_symbol": ticker_symbol, "reporting_year": 111, "reporting_season": 4, "version": "v1",
+         "流動資產": "", "現金及約當現金": 100.0 * i, "資產總額": 1000.0 * i}
+        for i, ticker_symbol in enumerate(["TEST", "TEST2"], start=1)
+    ]
+    response = requests.post(f'{base_url}create_reports/balance_sheet/', json=reports)
+    assert response.json()["stored"] == 2
+
+    # Line items come back typed, with the section headers in place
+    response = requests.get(f'{base_url}TEST/balance_sheet/111/4')
+    report = response.json()
+    assert list(report)[-3:] == ["流動資產", "現金及約當現金", "資產總額"]
+    assert report["流動資產"] == "" and report["資產總額"] == 1000
+
+    response = requests.get(f'{base_url}accounts/balance_sheet/資產總額/111/4')
+    assert response.status_code == 200
+    assert {k: v for k, v in response.json().items() if k.startswith("TEST")} == {"TEST": 1000, "TEST2": 2000}
+
+    for ticker_symbol in ["TEST", "TEST2"]:
+        requests.delete(f'{base_url}{ticker_symbol}/balance_sheet/111/4')
+
+
+def test_cross_section_query():
+    base_url = 'http://database-api/'
+
+    reports = [
+        {"ticker_symbol": ticker_symbol, "reporting_year": year, "reporting_season": season, "version": "v1",
+         "流動資產合計": 300.0, "流動負債合計": 100.0}
+        for ticker_symbol in ["TEST", "TEST2"] for year, season in [(111, 4), (112, 1)]
+    ]
+    response = requests.post(f'{base_url}create_reports/balance_sheet/', json=reports)
+    assert response.json()["stored"] == 4
+
+    query = {
+        "accounts": ["流動資產合計", "流動負債合計", "NO_SUCH_ACCOUNT"],
+        "ticker_symbols": ["TEST", "TEST2"],
+        "start": {"year": 111, "season": 4},
+        "end": {"year": 111, "season": 4},
+    }
+    response = requests.post(f'{base_url}query/balance_sheet', json=query)
+    assert response.status_code == 200
+    result = response.json()
+    assert result["rows"] == 2
+    assert result["columns"]["ticker_symbol"] == ["TEST", "TEST2"]
+    assert result["columns"]["流動資產合計"] == [300, 300]
+    assert result["columns"]["NO_SUCH_ACCOUNT"] == [None, None]
+
+    # A repeated account is one column, lined up with the rows
+    response = requests.post(f'{base_url}query/balance_sheet', json={**query, "accounts": ["流動負債合計", "流動資產合計", "流動負債合計"]})
+    result = response.json()
+    assert list(result["columns"])[-2:] == ["流動負債合計", "流動資產合計"]
+    assert result["columns"]["流動負債合計"] == [100, 100]
+
+    response = requests.post(f'{base_url}query/balance_sheet', json={**query, "accounts": ["version"]})
+    assert response.status_code == 400
+
+    for report in reports:
+        requests.delete(f'{base_url}{report["ticker_symbol"]}/balance_sheet/{report["reporting_year"]}/{report["reporting_season"]}')
@@ -0,0 +1,143 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+# vim:fenc=utf-8
+#
+# TradeWiSE Project
+#
+# This file is part of the TradeWiSE project, an automated trading and financial analysis platform.
+# It is licensed under the Mozilla Public License 2.0 (MPL 2.0), which allows for wide use and modification
+# while ensuring that enhancements and modifications remain available to the community.
+#
+# You can find the MPL 2.0 license in the root directory of the project or at https://www.mozilla.org/MPL/2.0/.
+#
+# Copyright (c) 2023 by wildfootw <wildfootw@wildfoo.tw>
+#
+
+import time
+
+import requests
+
+# The service runs with FakeSDK
+base_url = 'http://fugle-trading/'
+
+order = {"action": "buy", "price": 580, "stock_no": "2330", "quantity": 1}
+
+def wait_until_ready():
+    # The service logs in to the broker in the background
+    for _ in range(50):
+        response = requests.get(f'{base_url}ready')
+        if response.status_code == 200:
+            return response.json()
+        time.sleep(0.1)
+    assert response.status_code == 200
+
+def test_ready():
+    assert requests.get(f'{base_url}health').status_code == 200
+    session = wait_until_ready()
+    assert session['ready']
+    assert session['timings_ms']['login'] > 0
+
+def test_place_order():
+    wait_until_ready()
+    response = requests.post(f'{base_url}place_order', json=order)
+    assert response.status_code == 200
+    handle = response.json()
+    assert handle['status'] in ('queued', 'submitting', 'submitted')
+
+    for _ in range(50):
+        handle = requests.get(f'{base_url}place_order/{handle["id"]}').json()
+        if handle['status'] == 'submitted':
+            break
+        time.sleep(0.1)
+    assert handle['status'] == 'submitted'
+    assert handle['result']['ret_code'] == '000000'
+    assert handle['latency_ms']['broker'] > 0
+
+    response = requests.post(f'{base_url}place_order', params={'wait': True}, json=order)
+    assert response.json()['status'] == 'submitted'
+
+    response = requests.post(f'{base_url}place_order', json={**order, "quantity": 0})
+    assert 'error' in response.json()
+
+    assert requests.get(f'{base_url}place_order/unknown').status_code == 404
+
+def test_place_basket():
+    wait_until_ready()
+    response = requests.post(f'{base_url}place_basket', json={"orders": [order] * 10 + [{**order, "quantity": 0}]})
+    assert response.status_code == 200
+    result = response.json()
+    assert result['submitted']
+    assert [leg['status'] for leg in result['legs'][:10]] == ['submitted'] * 10
+    assert 'error' in result['legs'][10]
+
+    # One invalid order keeps the whole basket back
+    response = requests.post(f'{base_url}place_basket', json={"orders": [order, {**order, "quantity": 0}], "all_or_nothing": True})
+    result = response.json()
+    assert not result['submitted']
+    assert result['legs'][0] is None
+
+def test_account_snapshot():
+    for _ in range(50):
+        if requests.get(f'{base_url}balance').status_code == 200:
+            break
+        time.sleep(0.1)
+    balance = requests.get(f'{base_url}balance').json()['balance']['available_balance']
+
+    handle = requests.post(f'{base_url}place_order', params={'wait': True}, json={**order, "stock_no": "2454"}).json()
+    ord_no = handle['result']['ord_no']
+
+    # The order and its fill arrive through the callbacks, positions and balance are fetched after the fill
+    for _ in range(50):
+        positions = requests.get(f'{base_url}positions').json()['positions']
+        if any(position['stk_no'] == '2454' for position in positions):
+            break
+        time.sleep(0.1)
+    assert requests.get(f'{base_url}orders/{ord_no}').json()['order']['mat_qty'] == order['quantity']
+    assert any(fill['ord_no'] == ord_no for fill in requests.get(f'{base_url}fills').json()['fills'])
+    portfolio = requests.get(f'{base_url}portfolio').json()
+    assert any(position['stk_no'] == '2454' for position in portfolio['positions'])
+    assert portfolio['balance']['available_balance'] < balance
+
+def test_session_expired_order_not_repeated():
+    wait_until_ready()
+    fake = requests.post(f'{base_url}fake/expire_session').json()
+
+    # The broker may have the order already, so it is sent once and left for the snapshot to tell
+    handle = requests.post(f'{base_url}place_order', params={'wait': True}, json=order).json()
+    assert handle['status'] == 'unknown'
+    assert 'expired' in handle['error']
+    stats = requests.get(f'{base_url}stats').json()
+    assert stats['fake_sdk']['place_order_calls'] == fake['place_order_calls'] + 1
+    assert stats['fake_sdk']['logins'] == fake['logins'] + 1
+    assert not stats['fake_sdk']['session_expired']
+
+    # Logged in again for the next order
+    handle = requests.post(f'{base_url}place_order', params={'wait': True}, json=order).json()
+    assert handle['status'] == 'submitted'
+
+def test_fill_fetched_before_dealt_event():
+    wait_until_ready()
+    requests.post(f'{base_url}fake/hold_dealt')
+    try:
+        handle = requests.post(f'{base_url}place_order', params={'wait': True}, json={**order, "stock_no": "2317"}).json()
+        ord_no = handle['result']['ord_no']
+
+        # Wait for a reconcile that started after the order, it fetches the fill first
+        reconciliations = requests.get(f'{base_url}stats').json()['account']['reconciliations']
+        for _ in range(50):
+            if requests.get(f'{base_url}stats').json()['account']['reconciliations'] >= reconciliations + 2:
+                break
+            time.sleep(0.1)
+        assert requests.get(f'{base_url}orders/{ord_no}').json()['order']['mat_qty'] == order['quantity']
+        events = requests.get(f'{base_url}stats').json()['account']['events']
+    finally:
+        requests.post(f'{base_url}fake/release_dealt')
+
+    # Then the websocket delivers the same fill
+    for _ in range(50):
+        if requests.get(f'{base_url}stats').json()['account']['events'] > events:
+            break
+        time.sleep(0.1)
+    assert requests.get(f'{base_url}orders/{ord_no}').json()['order']['mat_qty'] == order['quantity']
+    fills = [fill for fill in requests.get(f'{base_url}fills').json()['fills'] if fill['ord_no'] == ord_no]
+    assert len(fills) == 1
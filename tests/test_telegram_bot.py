@@ -0,0 +1,68 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+# vim:fenc=utf-8
+#
+# TradeWiSE Project
+#
+# This file is part of the TradeWiSE project, an automated trading and financial analysis platform.
+# It is licensed under the Mozilla Public License 2.0 (MPL 2.0), which allows for wide use and modification
+# while ensuring that enhancements and modifications remain available to the community.
+#
+# You can find the MPL 2.0 license in the root directory of the project or at https://www.mozilla.org/MPL/2.0/.
+#
+# Copyright (c) 2023 by wildfootw <wildfootw@wildfoo.tw>
+#
+
+import time
+
+import requests
+
+# Stand-in Bot API, the bot runs in webhook mode against it
+base_url = 'http://bot-api/'
+
+def wait_for_webhook():
+    for _ in range(60):
+        try:
+            if requests.get(f'{base_url}webhook').json()['url']:
+                return
+        except requests.ConnectionError:
+            pass
+        time.sleep(0.5)
+    raise AssertionError('The bot did not register its webhook')
+
+def wait_for_messages(chat_id, count):
+    for _ in range(50):
+        messages = requests.get(f'{base_url}messages', params={'chat_id': chat_id}).json()
+        if len(messages) >= count:
+            return messages
+        time.sleep(0.1)
+    raise AssertionError(f'Expected {count} messages, got {len(messages)}')
+
+def test_webhook_reply():
+    wait_for_webhook()
+    requests.delete(f'{base_url}messages')
+
+    response = requests.post(f'{base_url}updates', json={'chat_id': 42, 'text': '/start'})
+    assert response.status_code == 200
+    assert response.json()['status_code'] == 200
+    messages = wait_for_messages(42, 1)
+    assert messages[0]['text'] == 'Welcome to TradeWiSE! Your trading assistant.'
+
+    # Other users are turned away
+    requests.post(f'{base_url}updates', json={'chat_id': 7, 'text': '/start'})
+    messages = wait_for_messages(7, 1)
+    assert messages[0]['text'] == 'Sorry, you are not authorized to use this bot.'
+
+def test_webhook_chat_order():
+    wait_for_webhook()
+    requests.delete(f'{base_url}messages')
+    requests.post(f'{base_url}updates', json={'chat_id': 42, 'text': '/watchlist clear'})
+    wait_for_messages(42, 1)
+
+    # Each reply lists the watchlist so far, they only grow one symbol at a time if the updates ran in order
+    symbols = [f'T{i:03d}' for i in range(20)]
+    for symbol in symbols:
+        requests.post(f'{base_url}updates', json={'chat_id': 42, 'text': f'/watchlist add {symbol}'})
+    messages = wait_for_messages(42, 1 + len(symbols))
+    for i, message in enumerate(messages[1:]):
+        assert message['text'] == f"Watchlist: {' '.join(symbols[:i + 1])}"
@@ -0,0 +1,169 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+# vim:fenc=utf-8
+#
+# TradeWiSE Project
+#
+# This file is part of the TradeWiSE project, an automated trading and financial analysis platform.
+# It is licensed under the Mozilla Public License 2.0 (MPL 2.0), which allows for wide use and modification
+# while ensuring that enhancements and modifications remain available to the community.
+#
+# You can find the MPL 2.0 license in the root directory of the project or at https://www.mozilla.org/MPL/2.0/.
+#
+# Copyright (c) 2023 by wildfootw <wildfootw@wildfoo.tw>
+#
+
+"""
+Compares the mops-crawler balance sheet parser with the original pandas.read_html based one.
+
+The corpus is either a directory of saved MOPS balance sheet pages named
+`<ticker_symbol>_<year>_<season>.html`, or the mops-crawler response cache directory.
+
+    python utils/mops_parser_benchmark.py check --corpus pages/
+    python utils/mops_parser_benchmark.py bench --cache-dir /var/cache/mops-crawler --rounds 5
+
+`check` verifies that both parsers produce byte-identical JSON for every page. `bench` runs each
+parser in its own process and reports throughput and peak RSS. Requires pandas, lxml and the
+mops-crawler requirements.
+"""
+
+import argparse
+import json
+import logging
+import re
+import resource
+import sqlite3
+import subprocess
+import sys
+import time
+import zlib
+from io import StringIO
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "services" / "mops-crawler" / "src"))
+
+def load_corpus(corpus_dir=None, cache_dir=None):
+    pages = []
+    if corpus_dir:
+        for path in sorted(Path(corpus_dir).glob("*.html")):
+            match = re.match(r"^(\w+)_(\d+)_([1-4])$", path.stem)
+            if not match:
+                print(f"Skipping {path.name}, expected <ticker_symbol>_<year>_<season>.html", file=sys.stderr)
+                continue
+            pages.append((int(match.group(2)), int(match.group(3)), path.read_text(encoding="utf-8")))
+    if cache_dir:
+        db = sqlite3.connect(str(Path(cache_dir) / "index.sqlite3"))
+        rows = db.execute(
+            "SELECT year, season, digest FROM entries WHERE report_type = 'balance_sheet' ORDER BY co_id, year, season"
+        ).fetchall()
+        for year, season, digest in rows:
+            body = (Path(cache_dir) / "objects" / digest[:2] / f"{digest}.zlib").read_bytes()
+            pages.append((year, season, zlib.decompress(body).decode("utf-8")))
+    return pages
+
+def parse_with_pandas(year, season, response_text):
+    import pandas
+
+    html_dataframe = pandas.read_html(StringIO(response_text))[1].fillna("")
+    season_to_date = {1: "03月31日", 2: "06月30日", 3: "09月30日", 4: "12月31日"}
+    date_col = f"{year}年{season_to_date[season]}"
+    year_season_col = f"民國{year}年第{season}季"
+    key_col_name = html_dataframe[year_season_col]["單位：新台幣仟元"]["會計項目"].columns[0]
+    keys = html_dataframe[year_season_col]["單位：新台幣仟元"]["會計項目"][key_col_name]
+    values = html_dataframe[year_season_col]["單位：新台幣仟元"][date_col]["金額"]
+    return dict(zip(keys, values))
+
+def parse_with_crawler(year, season, response_text):
+    from parsers import PARSERS
+
+    return PARSERS[("balance_sheet", "v1")](year, season, response_text)
+
+PARSERS = {"pandas": parse_with_pandas, "crawler": parse_with_crawler}
+
+def to_json(data):
+    # numpy scalars are serialized the same way FastAPI's encoder does
+    return json.dumps(data, ensure_ascii=False, default=lambda value: value.item()).encode("utf-8")
+
+def check(pages):
+    mismatches = 0
+    for i, (year, season, text) in enumerate(pages):
+        outputs = {}
+        for name, parser in PARSERS.items():
+            try:
+                outputs[name] = to_json(parser(year, season, text))
+            except Exception:
+                # Both parsers must reject the same pages, the exception types differ
+                outputs[name] = b"error"
+        if len(set(outputs.values())) != 1:
+            mismatches += 1
+            print(f"Page {i} ({year}Q{season}) differs: " + ", ".join(f"{k}={v[:200]!r}" for k, v in outputs.items()))
+    print(f"{len(pages) - mismatches}/{len(pages)} pages identical")
+    return 1 if mismatches else 0
+
+def parse_or_none(parser, year, season, text):
+    try:
+        return parser(year, season, text)
+    except Exception:
+        return None
+
+def run_parser(name, pages, rounds):
+    parser = PARSERS[name]
+    # Warm up the imports so that they are excluded from the throughput
+    year, season, text = pages[0]
+    parse_or_none(parser, year, season, text)
+    rss_after_import = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for year, season, text in pages:
+            parse_or_none(parser, year, season, text)
+    elapsed = time.perf_counter() - start
+
+    print(json.dumps({
+        "parser": name,
+        "pages": len(pages) * rounds,
+        "pages_per_second": len(pages) * rounds / elapsed,
+        "rss_after_warmup_kib": rss_after_import,
+        "peak_rss_kib": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    }))
+
+def bench(args):
+    results = []
+    for name in PARSERS:
+        command = [sys.executable, __file__, "run", name, "--rounds", str(args.rounds)]
+        if args.corpus:
+            command += ["--corpus", args.corpus]
+        if args.cache_dir:
+            command += ["--cache-dir", args.cache_dir]
+        output = subprocess.run(command, check=True, capture_output=True, text=True).stdout
+        results.append(json.loads(output.strip().splitlines()[-1]))
+
+    print(f"{'parser':<10}{'pages/s':>12}{'peak RSS (MiB)':>18}")
+    for result in results:
+        print(f"{result['parser']:<10}{result['pages_per_second']:>12.1f}{result['peak_rss_kib'] / 1024:>18.1f}")
+    baseline, candidate = results
+    print(f"speedup: {candidate['pages_per_second'] / baseline['pages_per_second']:.1f}x")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("mode", choices=["check", "bench", "run"])
+    parser.add_argument("name", nargs="?", choices=list(PARSERS), help=argparse.SUPPRESS)
+    parser.add_argument("--corpus", help="Directory of <ticker_symbol>_<year>_<season>.html pages")
+    parser.add_argument("--cache-dir", help="mops-crawler response cache directory")
+    parser.add_argument("--rounds", type=int, default=3, help="Number of passes over the corpus")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.CRITICAL)
+    pages = load_corpus(args.corpus, args.cache_dir)
+    if not pages:
+        parser.error("The corpus is empty")
+
+    if args.mode == "check":
+        sys.exit(check(pages))
+    elif args.mode == "bench":
+        bench(args)
+    else:
+        run_parser(args.name, pages, args.rounds)
+
+if __name__ == "__main__":
+    main()
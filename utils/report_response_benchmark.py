@@ -0,0 +1,104 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+# vim:fenc=utf-8
+#
+# TradeWiSE Project
+#
+# This file is part of the TradeWiSE project, an automated trading and financial analysis platform.
+# It is licensed under the Mozilla Public License 2.0 (MPL 2.0), which allows for wide use and modification
+# while ensuring that enhancements and modifications remain available to the community.
+#
+# You can find the MPL 2.0 license in the root directory of the project or at https://www.mozilla.org/MPL/2.0/.
+#
+# Copyright (c) 2023 by wildfootw <wildfootw@wildfoo.tw>
+#
+
+"""
+Compares the mongodb-api get_report response encoding paths on a balance sheet document.
+
+    python utils/report_response_benchmark.py --line-items 100 --seconds 3
+
+`roundtrip` is the former path: json.dumps with the ObjectId encoder, json.loads, then FastAPI's
+jsonable_encoder and JSONResponse. `orjson` is MongoJSONResponse, which encodes the document once.
+Both produce the same bytes, which is checked before timing. Requires the mongodb-api
+requirements.
+"""
+
+import argparse
+import json
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "services" / "mongodb-api" / "src"))
+
+from bson import ObjectId
+from bson.int64 import Int64
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+
+from utils.encoder import MongoJSONResponse
+
+
+class ObjectIdEncoder(json.JSONEncoder):
+    # The encoder get_report used before MongoJSONResponse, unchanged
+    def default(self, obj):
+        if isinstance(obj, ObjectId):
+            return str(obj)  # Convert ObjectId to string for JSON serialization
+        return super(ObjectIdEncoder, self).default(obj)
+
+def make_report(line_items):
+    report = {
+        "_id": ObjectId(),
+        "ticker_symbol": "2330",
+        "reporting_year": 112,
+        "reporting_season": 4,
+        "version": "v1",
+    }
+    for i in range(line_items):
+        if i % 10 == 0:
+            report[f"會計項目區段{i}"] = ""
+        else:
+            report[f"透過其他綜合損益按公允價值衡量之金融資產{i}"] = Int64(1342814083 + i * 7919)
+    return report
+
+def render_roundtrip(report):
+    content = json.loads(json.dumps(report, cls=ObjectIdEncoder))
+    return JSONResponse(jsonable_encoder(content)).body
+
+def render_orjson(report):
+    return MongoJSONResponse(report).body
+
+RENDERERS = {"roundtrip": render_roundtrip, "orjson": render_orjson}
+
+def measure(render, report, seconds):
+    count = 0
+    start = time.perf_counter()
+    deadline = start + seconds
+    while time.perf_counter() < deadline:
+        for _ in range(100):
+            render(report)
+        count += 100
+    return count / (time.perf_counter() - start)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--line-items", type=int, default=100, help="Number of line items of the report")
+    parser.add_argument("--seconds", type=float, default=3, help="Duration of each measurement")
+    args = parser.parse_args()
+
+    report = make_report(args.line_items)
+    bodies = {name: render(report) for name, render in RENDERERS.items()}
+    if len(set(bodies.values())) != 1:
+        print("Responses differ", file=sys.stderr)
+        sys.exit(1)
+
+    print(f"{'path':<12}{'responses/s':>14}{'body bytes':>12}")
+    results = {}
+    for name, render in RENDERERS.items():
+        results[name] = measure(render, report, args.seconds)
+        print(f"{name:<12}{results[name]:>14.0f}{len(bodies[name]):>12}")
+    print(f"speedup: {results['orjson'] / results['roundtrip']:.1f}x")
+
+if __name__ == "__main__":
+    main()